@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+'''
+Times removing urls with the scanner in hashkov.urls against John Gruber's
+regex, on ordinary tweets and on texts made to make the regex backtrack.
+The regex is given a deadline on each text, since it can take hours.
+'''
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import timeit
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from hashkov import urls
+
+
+def texts(size):
+    '''
+    Return the texts to time with, by name, with their adversarial parts
+    repeated to the size given.
+    '''
+    return [
+        ('tweet', 'Check out http://t.co/abc123 and www.example.com, #wow '
+                  'so @cool (see example.org/a_(b)) ok.'),
+        ('dots', 'http://x' + '.' * size + ' '),
+        ('punctuation', 'www.a' + ',!?;' * (size // 4) + ' '),
+        ('parentheses', 'http://x' + '(a)' * (size // 3) + '(('),
+        ('schemes', 'a-' * (size // 2) + ':' + '!' * size),
+    ]
+
+
+def _time_regex(text, number, result):
+    '''
+    Time the regex on the text, putting the seconds per run in the result.
+    '''
+    regex = re.compile(urls.GRUBER)
+    result.value = timeit.timeit(lambda: regex.sub('', text),
+                                 number=number) / number
+
+
+def time_regex(text, number, deadline):
+    '''
+    Return the seconds the regex takes per run on the text, or None if it's
+    not done within the deadline.
+    '''
+    result = multiprocessing.Value('d', -1.0)
+    process = multiprocessing.Process(target=_time_regex,
+                                      args=(text, number, result))
+    process.start()
+    process.join(deadline)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return None
+    return result.value
+
+
+def main():
+    '''
+    Run the benchmark.
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark url removal.')
+    parser.add_argument('-s', '--size', dest='size', type=int, default=40,
+                        help='How long to make the adversarial texts')
+    parser.add_argument('-n', '--number', dest='number', type=int,
+                        default=100, help='How many times to run each text')
+    parser.add_argument('-d', '--deadline', dest='deadline', type=float,
+                        default=10, help='Seconds to give the regex')
+    opts = parser.parse_args()
+    print('%-12s %8s %14s %14s' % ('text', 'length', 'scanner (us)',
+                                   'regex (us)'))
+    for (name, text) in texts(opts.size):
+        scanner = timeit.timeit(lambda: urls.remove_urls(text),
+                                number=opts.number) / opts.number
+        regex = time_regex(text, opts.number, opts.deadline)
+        print('%-12s %8d %14.1f %14s' % (
+            name, len(text), scanner * 1e6,
+            'timed out' if regex is None else '%.1f' % (regex * 1e6)))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
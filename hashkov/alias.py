@@ -0,0 +1,72 @@
+'''
+Provides alias tables, for drawing from weighted choices in constant time.
+'''
+from array import array
+import random
+
+
+class AliasTable(object):
+    '''
+    A Walker/Vose alias table over a list of values and their integer
+    weights.
+    Every value gets a bucket; a bucket holds its own value up to a cutoff
+    and an alias (some other value) beyond it. Drawing picks a bucket and a
+    point in it, so it takes one random number no matter how many values
+    there are. Weights are kept as integers, so the draws are exact.
+    '''
+    def __init__(self, values, weights):
+        '''
+        Build the table for the values given, weighted by the weights given.
+        '''
+        size = len(values)
+        total = sum(weights)
+        self.values = values
+        self.total = total
+        self.cutoffs = array('Q', [total]) * size
+        self.aliases = array('I', range(size))
+        scaled = [weight * size for weight in weights]
+        small = [i for i in range(size) if scaled[i] < total]
+        large = [i for i in range(size) if scaled[i] >= total]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.cutoffs[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] -= total - scaled[less]
+            if scaled[more] < total:
+                small.append(more)
+            else:
+                large.append(more)
+
+    def __len__(self):
+        '''Return the number of values in the table.'''
+        return len(self.values)
+
+    def draw(self, rng=random):
+        '''
+        Draw a value from the table, using the random number generator given.
+        '''
+        (bucket, point) = divmod(rng.randrange(len(self.values) * self.total),
+                                 self.total)
+        if point < self.cutoffs[bucket]:
+            return self.values[bucket]
+        return self.values[self.aliases[bucket]]
+
+    def draw_many(self, count, rng=random):
+        '''
+        Draw count values from the table, returning them as a list.
+        '''
+        values = self.values
+        cutoffs = self.cutoffs
+        aliases = self.aliases
+        total = self.total
+        randrange = rng.randrange
+        span = len(values) * total
+        drawn = []
+        for i in range(count):
+            (bucket, point) = divmod(randrange(span), total)
+            if point < cutoffs[bucket]:
+                drawn.append(values[bucket])
+            else:
+                drawn.append(values[aliases[bucket]])
+        return drawn
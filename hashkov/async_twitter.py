@@ -0,0 +1,111 @@
+'''
+Communicates with twitter from asyncio code.
+'''
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashkov.rate_limit import RETRY_STATUSES
+from hashkov.twitter import TwitterException
+
+
+class AsyncTwitter(object):
+    '''
+    An asyncio twitter client, with the same methods as Twitter but as
+    coroutines, which makes its requests through the Twitter client given.
+    Requests run in a pool of threads, at most concurrency of them at a
+    time, so many hashtags can be searched at once. Signing and errors are
+    exactly those of the Twitter client: a failed request raises a
+    TwitterException.
+    The Twitter client's pool should have room for concurrency connections,
+    or the extra ones won't be kept alive.
+    The client can be used from one event loop after another, but not from
+    several at once.
+    '''
+    def __init__(self, twitter, concurrency=8):
+        '''
+        Initialize this client to make requests through the Twitter client
+        given, concurrency at a time.
+        '''
+        self.twitter = twitter
+        self.concurrency = concurrency
+        # The semaphore is made for the loop that's running, since it can
+        # only be used from the one loop
+        self.loop = None
+        self.semaphore = None
+        self.executor = ThreadPoolExecutor(concurrency)
+
+    async def search_by_hashtag(self, hashtag, pages=1, lang=None):
+        '''
+        Search tweets by hashtag, a page at a time.
+        Return a list of tweets. Like Twitter.iter_pages, if a page past the
+        first can't be fetched even after retrying, the tweets fetched so far
+        are all there is, rather than an error.
+        '''
+        (results, next_page) = await self._call(self.twitter.search_page,
+                                                hashtag, lang)
+        for page in range(1, pages):
+            if next_page is None:
+                break
+            try:
+                (tweets, next_page) = await self._call(
+                    self.twitter.search_page, hashtag, lang, next_page)
+            except TwitterException as e:
+                if e.status_code not in RETRY_STATUSES:
+                    raise
+                break
+            results.extend(tweets)
+        return results
+
+    async def search_many(self, hashtags, pages=1, lang=None):
+        '''
+        Search tweets by every hashtag in the list given at once.
+        Return a dict of each hashtag to its list of tweets.
+        '''
+        found = await asyncio.gather(*(self.search_by_hashtag(hashtag, pages,
+                                                              lang)
+                                       for hashtag in hashtags))
+        return dict(zip(hashtags, found))
+
+    async def get_trending(self, woeid):
+        '''
+        Get a list of trending hashtags for the place with the woeid given.
+        '''
+        return await self._call(self.twitter.get_trending, woeid)
+
+    async def tweet(self, tweet):
+        '''
+        Tweet something.
+        '''
+        await self._call(self.twitter.tweet, tweet)
+
+    def close(self):
+        '''
+        Stop the threads requests run in, and close the Twitter client.
+        '''
+        self.executor.shutdown()
+        self.twitter.close()
+
+    async def __aenter__(self):
+        '''Use the client in an async with statement, closing it at the end.'''
+        return self
+
+    async def __aexit__(self, *exc_info):
+        '''
+        Close the client, waiting for its threads to stop in another thread
+        rather than on the event loop.
+        '''
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.close)
+
+    async def _call(self, function, *args):
+        '''
+        Call the blocking function given with the args given in a thread,
+        once there's room for another request.
+        '''
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            return await loop.run_in_executor(self.executor,
+                                              partial(function, *args))
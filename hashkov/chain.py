@@ -1,44 +1,340 @@
 '''
 Provides the Markov Chain implementation.
 '''
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import os
 import random
+import time
+from hashkov.alias import AliasTable
+from hashkov.contexts import ContextTrie, ROOT
+from hashkov.index import WordIndex
+from hashkov.vocabulary import Vocabulary
+
+# The id of the empty token, which every sample starts from.
+START = 0
 
 
 class MarkovChain(object):
     '''
     A Markov chain.
+
+    The chain's order is how many of the previous tokens make up a state.
+    Tokens are interned in a vocabulary, states are nodes in a trie of
+    contexts (the ids of their lowercased tokens, newest first, with the
+    empty token standing in for whatever came before the start of a
+    sample), and the transitions between them are kept as a compressed
+    sparse row table: the successors of state s live in
+    successors[offsets[s]:offsets[s + 1]], with the number of times each
+    one was seen at the same position in counts.
+    Lowercased tokens are also indexed by the words in them, to find the
+    ones a sample can start with quickly.
+    Freshly trained transitions go into a small pending table first, which
+    gets folded into the arrays by compact().
+    Sampling draws from an alias table per state, built the first time the
+    state is sampled and thrown away when training touches the state.
+    Once the chain is backed by a chain file (journaled is set), the
+    transitions learned since they were last taken with take_unsaved() are
+    also kept aside, so that they can be saved on their own. Decaying,
+    pruning or evicting transitions rebuilds the whole chain instead, which
+    sets rebuilt until the chain is saved in full.
     '''
-    def __init__(self):
+
+    # Pending transitions are compacted once they outgrow this many, or a
+    # quarter of the transitions in the arrays if that's larger.
+    compact_threshold = 4096
+
+    # How many times a sample with a budget draws a token before giving up
+    # on finding one that fits.
+    fit_attempts = 8
+
+    def __init__(self, order=1):
+        '''
+        Construct a Markov chain of the order given.
+        '''
+        self.order = order
+        self.vocabulary = Vocabulary()
+        # For every token id, the id of its lowercased version.
+        self.keys = array('I')
+        self.contexts = ContextTrie()
+        self.words = WordIndex()
+        self.offsets = array('I', [0])
+        self.successors = array('I')
+        self.counts = array('I')
+        # Maps a state to a dict of successor ids to counts.
+        self.pending = {}
+        self.pending_size = 0
+        # Maps a state to a dict of successor ids to counts, like pending,
+        # but only filled in while the chain is journaled.
+        self.unsaved = {}
+        self.journaled = False
+        self.rebuilt = False
+        # When the counts were last decayed, in seconds since the epoch.
+        self.decayed_at = time.time()
+        self._aliases = {}
+        self.intern('')
+
+    def __getstate__(self):
+        '''
+        Compact the chain before pickling it, so only the arrays are stored.
+        A chain opened from a chain file has its tables copied out of the
+        file, since the file's buffers can't be pickled.
+        '''
+        self.compact()
+        state = self.__dict__.copy()
+        del state['_aliases']
+        if self.vocabulary.table:
+            state.update(self._copy_tables())
+        return state
+
+    def __setstate__(self, state):
+        '''
+        Restore a pickled chain.
+        Chains pickled before the arrays were introduced keep a memory dict
+        of lowercased tokens to their successors (as a list with every
+        successor ever seen, or as a dict of counts), so convert those.
+        '''
+        if 'memory' not in state:
+            self.journaled = False
+            self.__dict__.update(state)
+            self._aliases = {}
+            return
+        self.__init__()
+        for key, successors in state['memory'].items():
+            if isinstance(successors, list):
+                successors = {token: successors.count(token)
+                              for token in set(successors)}
+            prev = self.contexts.intern([self.keys[self.intern(key)]])
+            for token, count in successors.items():
+                self._add(prev, self.intern(token), count)
+        self.compact()
+
+    @property
+    def memory(self):
         '''
-        Construct the Markov chain.
+        Return the transitions as a dict mapping each state to a dict of the
+        tokens seen following it, and how many times each one was seen.
+        In a first order chain a state is a lowercased token, else it's a
+        tuple of them, oldest first.
         '''
-        self.memory = {}
+        vocabulary = self.vocabulary
+        memory = {}
+        for state in self._states():
+            key = self._context(state)
+            if self.order == 1:
+                key = key[0]
+            memory[key] = {vocabulary[token]: count for token, count
+                           in zip(*self._transitions(state))}
+        return memory
 
     def train(self, samples):
         '''
-        Train the markov chain with a list of samples.
+        Train the markov chain with an iterable of samples.
         Each sample itself is a list of tokens that the chain
         will look at.
         '''
+        self.train_ids(map(self.intern, sample) for sample in samples)
+
+    def train_ids(self, samples):
+        '''
+        Train the markov chain with an iterable of samples that are lists of
+        token ids handed out by intern(), such as the ones a Tokenizer makes
+        when it interns into this chain.
+        '''
         for sample in samples:
-            prev = ''  # The start
-            for token in sample:
-                prev_mem = self.memory.setdefault(prev.lower(), [])
-                prev_mem.append(token)
-                prev = token
+            context = [START] * self.order
+            for token_id in sample:
+                self._add(self.contexts.intern(context), token_id, 1)
+                context.insert(0, self.keys[token_id])
+                context.pop()
+        self._compact_if_needed()
 
-    def sample(self, length, start_token=''):
+    def intern(self, token):
+        '''
+        Return the id of the token given, interning it (and its lowercased
+        version) if need be.
+        Ids are only meaningful to this chain, and change when decay(),
+        prune() or evict() rebuild it.
+        '''
+        token_id = self.vocabulary.get(token)
+        if token_id is not None:
+            return token_id
+        key = token.lower()
+        key_id = self.intern(key) if key != token else len(self.vocabulary)
+        token_id = self.vocabulary.intern(token)
+        self.keys.append(key_id)
+        if key_id == token_id:
+            self.words.add(token_id, token)
+        return token_id
+
+    def add_transitions(self, transitions):
+        '''
+        Add the transitions given to the chain, as (context, token, count)
+        tuples like the ones transitions() returns.
+        '''
+        for (context, token, count) in transitions:
+            context = [self.keys[self.intern(key)]
+                       for key in reversed(context)]
+            self._add(self.contexts.intern(context), self.intern(token),
+                      count)
+        self._compact_if_needed()
+
+    def merge(self, other):
+        '''
+        Add every transition in the other chain given to this one, as if it
+        had been trained with the other chain's samples too.
+        '''
+        if other.order != self.order:
+            raise ValueError('Cannot merge a chain of order %d into one of'
+                             ' order %d' % (other.order, self.order))
+        # Translate the other chain's ids to ours once, rather than looking
+        # its tokens up for every transition
+        tokens = array('I', (self.intern(other.vocabulary[token_id])
+                             for token_id in range(len(other.vocabulary))))
+        nodes = array('I', [ROOT])
+        for node in range(1, len(other.contexts)):
+            # A node always comes after its parent
+            parent = nodes[other.contexts.parents[node]]
+            key = tokens[other.contexts.keys[node]]
+            nodes.append(self.contexts.child(parent, key, True))
+        for state in other._states():
+            (successors, counts) = other._transitions(state)
+            self._add_row(nodes[state],
+                          [tokens[token_id] for token_id in successors],
+                          counts)
+        self._compact_if_needed()
+
+    def transitions(self):
+        '''
+        Iterate over every transition in the chain, as a tuple of (context,
+        token, count), where the context is a tuple of the lowercased tokens
+        the transition comes from, oldest first.
+        '''
+        vocabulary = self.vocabulary
+        for state in self._states():
+            context = self._context(state)
+            for (token_id, count) in zip(*self._transitions(state)):
+                yield (context, vocabulary[token_id], count)
+
+    def take_unsaved(self):
+        '''
+        Return a list of the transitions learned since the last call, as
+        (context, token, count) tuples like the ones transitions() returns,
+        and forget about them.
+        '''
+        vocabulary = self.vocabulary
+        unsaved = [(self._context(state), vocabulary[token_id], count)
+                   for (state, row) in self.unsaved.items()
+                   for (token_id, count) in row.items()]
+        self.unsaved = {}
+        return unsaved
+
+    def decay(self, factor, rng=random):
+        '''
+        Multiply every count in the chain by the factor given, which should
+        be between 0 and 1, dropping the transitions that reach 0.
+        Counts are rounded up or down at random, in proportion to how close
+        they are to either side, so that on average they're scaled exactly.
+        '''
+        self._rebuild(lambda counts: [int(count * factor + rng.random())
+                                      for count in counts])
+
+    def prune(self, threshold):
+        '''
+        Drop the transitions seen fewer times than the threshold given.
+        '''
+        self._rebuild(lambda counts: [count if count >= threshold else 0
+                                      for count in counts])
+
+    def evict(self, max_transitions):
+        '''
+        Drop the states that were left the fewest times until there are no
+        more than the number of transitions given.
+        On a chain that's decayed regularly this favours states that have
+        been seen recently as well as often.
+        '''
+        self.compact()
+        if len(self.successors) <= max_transitions:
+            return
+        states = sorted(self._states(), key=lambda state: (
+            sum(self._transitions(state)[1]), state))
+        size = len(self.successors)
+        evicted = set()
+        for state in states:
+            if size <= max_transitions:
+                break
+            (start, end) = self._bounds(state)
+            size -= end - start
+            evicted.add(state)
+        self._rebuild(lambda counts: counts, evicted)
+
+    def size(self):
+        '''
+        Return the number of transitions in the chain.
+        '''
+        self.compact()
+        return len(self.successors)
+
+    def sample(self, length, start_token='', budget=None):
         '''
         Sample the chain, returning a list of tokens of the length given.
         Optionally, force it to start with the token given.
+        If a budget is given, stop before the tokens joined by spaces (not
+        counting an empty start token) would be longer than it.
+        '''
+        return self.sample_many(1, length, start_token, budget)[0]
+
+    def sample_many(self, n, length, start_token='', budget=None):
+        '''
+        Sample the chain n times, returning a list of n lists of tokens, just
+        like the ones sample() returns.
+        The samples are walked in lockstep: at every step the walks sitting
+        in the same state draw their next tokens from its table together.
+        A walk that draws a token that doesn't fit in the budget draws again,
+        up to fit_attempts times, and ends if none of them fit.
         '''
-        if not length:
-            return [start_token]
-        token_mem = self.memory.get(start_token.lower())
-        if token_mem is None or len(token_mem) == 0:
-            return [start_token]  # Chain's over folks
-        next_token = random.choice(token_mem)
-        return [start_token] + self.sample(length - 1, next_token)
+        walks = [[start_token] for i in range(n)]
+        (starts, weights) = self._starts(start_token)
+        if not starts:
+            return walks
+        vocabulary = self.vocabulary
+        keys = self.keys
+        # The empty start token takes no room, and has no space after it
+        used = len(start_token) if start_token else -1
+        states = {}
+        for (walk, state) in zip(walks,
+                                 random.choices(starts, weights, k=n)):
+            states.setdefault(state, []).append((walk, used))
+        for step in range(length):
+            next_states = {}
+            for (state, group) in states.items():
+                table = self._alias(state)
+                if table is None:
+                    continue  # Chain's over folks
+                drawn = table.draw_many(len(group))
+                shifted = {}
+                for ((walk, used), token_id) in zip(group, drawn):
+                    token = vocabulary[token_id]
+                    if budget is not None:
+                        attempts = 1
+                        while (used + 1 + len(token) > budget and
+                               attempts < self.fit_attempts):
+                            token_id = table.draw()
+                            token = vocabulary[token_id]
+                            attempts += 1
+                        if used + 1 + len(token) > budget:
+                            continue  # Out of room
+                    walk.append(token)
+                    key = keys[token_id]
+                    if key not in shifted:
+                        shifted[key] = self._shift(state, key)
+                    next_states.setdefault(shifted[key], []).append(
+                        (walk, used + 1 + len(token)))
+            next_states.pop(None, None)
+            if not next_states:
+                break
+            states = next_states
+        return walks
 
     def get_possible_starts(self):
         '''
@@ -47,4 +343,291 @@ class MarkovChain(object):
         Note that these are always in lowercase because of implementation
         details.
         '''
-        return self.memory.keys()
+        contexts = self.contexts
+        return [self.vocabulary[contexts.keys[node]]
+                for node in contexts.children_of(ROOT)]
+
+    def find_starts(self, word):
+        '''
+        Return the possible starting tokens with the word given in them,
+        like get_possible_starts() does, but without looking at the rest.
+        '''
+        word = word.lower()
+        return [self.vocabulary[key] for key in self.words.find(word)
+                if self.contexts.child(ROOT, key) is not None]
+
+    def compact(self):
+        '''
+        Fold the pending transitions into the arrays.
+        '''
+        if not self.pending:
+            return
+        offsets = array('I', [0])
+        successors = array('I')
+        counts = array('I')
+        for state in range(len(self.contexts)):
+            pending = self.pending.get(state)
+            if pending is None:
+                (start, end) = self._bounds(state)
+                successors.extend(self.successors[start:end])
+                counts.extend(self.counts[start:end])
+            else:
+                row = self._transitions(state)
+                successors.extend(row[0])
+                counts.extend(row[1])
+            offsets.append(len(successors))
+        self.offsets = offsets
+        self.successors = successors
+        self.counts = counts
+        self.pending = {}
+        self.pending_size = 0
+
+    def _rebuild(self, rescale, evicted=()):
+        '''
+        Rebuild the chain with the counts of every state's transitions
+        replaced by what the rescale function returns for them, dropping the
+        transitions that get a count of 0, and the evicted states given.
+        Tokens and contexts that no transitions are left for are dropped too.
+        '''
+        chain = MarkovChain(self.order)
+        tokens = {}
+        for state in self._states():
+            if state in evicted:
+                continue
+            (successors, counts) = self._transitions(state)
+            row = [(token_id, count) for (token_id, count)
+                   in zip(successors, rescale(counts)) if count > 0]
+            if not row:
+                continue
+            for (token_id, count) in row:
+                if token_id not in tokens:
+                    tokens[token_id] = chain.intern(self.vocabulary[token_id])
+            context = [chain.intern(self.vocabulary[key])
+                       for key in self.contexts.path(state)]
+            chain._add_row(chain.contexts.intern(context),
+                           [tokens[token_id] for (token_id, count) in row],
+                           [count for (token_id, count) in row])
+        chain.compact()
+        chain.journaled = self.journaled
+        chain.rebuilt = True
+        chain.decayed_at = self.decayed_at
+        self.__dict__.update(chain.__dict__)
+
+    def _copy_tables(self):
+        '''
+        Return a dict of copies of the vocabulary, keys, contexts, word index
+        and arrays of the chain that don't use the buffers of a chain file.
+        The copy isn't journaled, since it's no longer backed by the file.
+        '''
+        vocabulary = Vocabulary()
+        for token_id in range(len(self.vocabulary)):
+            vocabulary.intern(self.vocabulary[token_id])
+        contexts = ContextTrie()
+        contexts.parents = array('I', self.contexts.parents)
+        contexts.keys = array('I', self.contexts.keys)
+        contexts.first_children = array('I', self.contexts.first_children)
+        contexts.next_siblings = array('I', self.contexts.next_siblings)
+        contexts.children = {(contexts.parents[node] << 32) |
+                             contexts.keys[node]: node
+                             for node in range(1, len(contexts))}
+        words = WordIndex()
+        for (word, found) in self.words.items():
+            words.extra[word] = array('I', found)
+        return {'vocabulary': vocabulary, 'keys': array('I', self.keys),
+                'contexts': contexts, 'words': words,
+                'offsets': array('I', self.offsets),
+                'successors': array('I', self.successors),
+                'counts': array('I', self.counts),
+                'unsaved': {}, 'journaled': False}
+
+    def _compact_if_needed(self):
+        '''
+        Compact the chain if the pending transitions have grown too many.
+        '''
+        threshold = max(self.compact_threshold, len(self.successors) // 4)
+        if self.pending_size > threshold:
+            self.compact()
+
+    def _context(self, state):
+        '''
+        Return the context of the state given as a tuple of lowercased
+        tokens, oldest first.
+        '''
+        return tuple(self.vocabulary[key] for key
+                     in reversed(self.contexts.path(state)))
+
+    def _add(self, state, token_id, count):
+        '''
+        Record count more transitions from the state to the token given.
+        '''
+        self._aliases.pop(state, None)
+        pending = self.pending.setdefault(state, {})
+        if token_id not in pending:
+            self.pending_size += 1
+            pending[token_id] = count
+        else:
+            pending[token_id] += count
+        if self.journaled:
+            unsaved = self.unsaved.setdefault(state, {})
+            unsaved[token_id] = unsaved.get(token_id, 0) + count
+
+    def _add_row(self, state, token_ids, counts):
+        '''
+        Record more transitions from the state given, count for count to the
+        tokens given.
+        '''
+        self._aliases.pop(state, None)
+        pending = self.pending.setdefault(state, {})
+        size = len(pending)
+        for (token_id, count) in zip(token_ids, counts):
+            pending[token_id] = pending.get(token_id, 0) + count
+        self.pending_size += len(pending) - size
+        if self.journaled:
+            unsaved = self.unsaved.setdefault(state, {})
+            for (token_id, count) in zip(token_ids, counts):
+                unsaved[token_id] = unsaved.get(token_id, 0) + count
+
+    def _alias(self, state):
+        '''
+        Return the alias table for the state given, or None if it has no
+        successors.
+        '''
+        try:
+            return self._aliases[state]
+        except KeyError:
+            pass
+        (successors, counts) = self._transitions(state)
+        table = AliasTable(successors, counts) if successors else None
+        self._aliases[state] = table
+        return table
+
+    def _bounds(self, state):
+        '''
+        Return the (start, end) of the state's row in the arrays.
+        '''
+        if state + 1 >= len(self.offsets):
+            return (0, 0)
+        return (self.offsets[state], self.offsets[state + 1])
+
+    def _transitions(self, state):
+        '''
+        Return a tuple of (successor ids, counts) for the state given,
+        including pending transitions.
+        '''
+        (start, end) = self._bounds(state)
+        successors = self.successors[start:end]
+        counts = self.counts[start:end]
+        pending = self.pending.get(state)
+        if pending:
+            row = dict(zip(successors, counts))
+            for token_id, count in pending.items():
+                row[token_id] = row.get(token_id, 0) + count
+            successors = list(row)
+            counts = list(row.values())
+        return (successors, counts)
+
+    def _shift(self, state, key):
+        '''
+        Return the state the chain moves to from the state given when the
+        token with the key given comes next, or None if the chain has never
+        been there.
+        '''
+        context = self.contexts.path(state)
+        context.insert(0, key)
+        context.pop()
+        return self.contexts.find(context)
+
+    def _starts(self, start_token):
+        '''
+        Return a tuple of (states, weights) that a sample forced to start
+        with the token given can start from: every state whose newest token
+        is the one given, weighted by how often the state was left.
+        '''
+        key = self.vocabulary.get(start_token.lower())
+        if key is None:
+            return ([], [])
+        node = self.contexts.child(ROOT, self.keys[key])
+        if node is None:
+            return ([], [])
+        states = []
+        weights = []
+        for state in self.contexts.descendants(node, self.order - 1):
+            table = self._alias(state)
+            if table is not None:
+                states.append(state)
+                weights.append(table.total)
+        return (states, weights)
+
+    def _states(self):
+        '''
+        Iterate over the states that have at least one successor.
+        '''
+        for state in range(len(self.contexts)):
+            (start, end) = self._bounds(state)
+            if start != end or state in self.pending:
+                yield state
+
+
+class MemoryBudget(object):
+    '''
+    A policy to keep a markov chain from growing forever: its counts decay
+    with the half life given (in seconds), no more often than the interval
+    given, and transitions seen fewer times than the threshold are then
+    pruned. On top of that, if the chain has more transitions than the
+    maximum given, its coldest states are evicted.
+    '''
+    def __init__(self, half_life=None, threshold=1, max_transitions=None,
+                 interval=24 * 60 * 60):
+        '''
+        Initialize the budget. Leaving the half life or the maximum number of
+        transitions out turns off decay or eviction.
+        '''
+        self.half_life = half_life
+        self.threshold = threshold
+        self.max_transitions = max_transitions
+        self.interval = interval
+
+    def enforce(self, chain, now=None):
+        '''
+        Decay, prune and evict the chain given as needed.
+        '''
+        if now is None:
+            now = time.time()
+        elapsed = now - chain.decayed_at
+        if self.half_life is not None and elapsed >= self.interval:
+            chain.decay(0.5 ** (elapsed / self.half_life))
+            chain.decayed_at = now
+            if self.threshold > 1:
+                chain.prune(self.threshold)
+        if (self.max_transitions is not None and
+                chain.size() > self.max_transitions):
+            chain.evict(self.max_transitions)
+
+
+def train_parallel(samples, order=1, shards=None, workers=None):
+    '''
+    Train a new markov chain of the order given with a list of samples,
+    splitting them into shards that are trained in separate processes, and
+    merging the results together.
+    By default there's one worker per cpu, and one shard per worker.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if shards is None:
+        shards = workers
+    size = -(-len(samples) // shards) or 1
+    pieces = [samples[i:i + size] for i in range(0, len(samples), size)]
+    chain = MarkovChain(order)
+    with ProcessPoolExecutor(workers) as executor:
+        for shard in executor.map(_train_shard, pieces, [order] * len(pieces)):
+            chain.merge(shard)
+    return chain
+
+
+def _train_shard(samples, order):
+    '''
+    Train a new markov chain of the order given with the samples given.
+    '''
+    chain = MarkovChain(order)
+    chain.train(samples)
+    return chain
@@ -0,0 +1,420 @@
+'''
+Saves Markov chains to, and opens them from, chain files.
+
+A chain file holds the chain's arrays laid out one after the other, so
+opening it just maps it into memory: nothing is read until a sample needs
+it, and every process that opens the same file shares the same pages.
+
+Next to a chain file there can be a journal, which the transitions learned
+since the file was written are appended to, so saving a chain doesn't mean
+rewriting all of it. A journal belongs to the generation of the chain file
+it was started for, and is ignored once the file is rewritten.
+'''
+from array import array
+from bisect import bisect_left
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from hashkov.chain import MarkovChain
+from hashkov.contexts import ContextTrie
+from hashkov.files import atomic_write
+from hashkov.index import WordIndex
+from hashkov.vocabulary import Vocabulary
+
+MAGIC = b'HKVC'
+VERSION = 4
+
+# Magic, version, byte order of the arrays, order of the chain, generation,
+# when the chain was last decayed, the number of tokens, nodes, transitions
+# and bytes of token text, and the number of indexed words, bytes of word
+# text and word postings.
+HEADER = struct.Struct('<4sHcxIQdQQQQQQQ')
+
+JOURNAL_MAGIC = b'HKVJ'
+
+# Magic and the generation of the chain file the journal belongs to.
+JOURNAL_HEADER = struct.Struct('<4sQ')
+
+# The length and CRC-32 of the record that follows.
+RECORD_HEADER = struct.Struct('<II')
+
+# A chain file gets rewritten once its journal is this big compared to it.
+COMPACT_RATIO = 0.5
+
+# The sections after the header, in order, with their type codes. Each
+# section starts at a multiple of 8 bytes.
+SECTIONS = [('token_offsets', 'Q'), ('text', 'B'), ('token_order', 'I'),
+            ('keys', 'I'), ('parents', 'I'), ('node_keys', 'I'),
+            ('first_children', 'I'), ('next_siblings', 'I'),
+            ('child_index', 'Q'), ('child_nodes', 'I'), ('offsets', 'I'),
+            ('successors', 'I'), ('counts', 'I'), ('word_offsets', 'Q'),
+            ('word_text', 'B'), ('posting_offsets', 'Q'), ('postings', 'I')]
+
+
+class ChainFileException(Exception):
+    '''
+    An exception in case a chain file can't be read.
+    '''
+
+
+class StringTable(object):
+    '''
+    A read only table of tokens in a buffer: their UTF-8 text back to back,
+    the offset each one starts at, and their ids sorted by text for lookups.
+    '''
+    def __init__(self, offsets, text, order):
+        '''
+        Initialize the table with the buffers given.
+        '''
+        self.offsets = offsets
+        self.text = text
+        self.order = order
+
+    def __len__(self):
+        '''Return how many tokens are in the table.'''
+        return len(self.order)
+
+    def __getitem__(self, token_id):
+        '''Return the token with the id given.'''
+        return str(self.text[self.offsets[token_id]:
+                             self.offsets[token_id + 1]], 'utf-8')
+
+    def find(self, token):
+        '''
+        Return the id of the token given, or None if it isn't in the table.
+        '''
+        encoded = token.encode('utf-8')
+        low = 0
+        high = len(self.order)
+        while low < high:
+            middle = (low + high) // 2
+            token_id = self.order[middle]
+            found = self.text[self.offsets[token_id]:
+                              self.offsets[token_id + 1]].tobytes()
+            if found == encoded:
+                return token_id
+            if found < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+
+class ChildTable(object):
+    '''
+    A read only table of the nodes of a context trie in a buffer: the
+    (parent << 32 | token) key of every node, sorted, and the nodes with
+    those keys.
+    '''
+    def __init__(self, index, nodes):
+        '''
+        Initialize the table with the buffers given.
+        '''
+        self.index = index
+        self.nodes = nodes
+
+    def get(self, key):
+        '''
+        Return the node with the key given, or None if there isn't one.
+        '''
+        position = bisect_left(self.index, key)
+        if position < len(self.index) and self.index[position] == key:
+            return self.nodes[position]
+        return None
+
+
+class OverlayArray(object):
+    '''
+    An array laid over a read only buffer. Items are read from the buffer,
+    while changes to them and any appended items are kept in memory.
+    '''
+    def __init__(self, base, typecode):
+        '''
+        Initialize the array on top of the buffer given.
+        '''
+        self.base = base
+        self.extra = array(typecode)
+        self.changes = {}
+
+    def __len__(self):
+        '''Return the length of the array.'''
+        return len(self.base) + len(self.extra)
+
+    def __getitem__(self, index):
+        '''Return the item at the index given.'''
+        if index >= len(self.base):
+            return self.extra[index - len(self.base)]
+        if self.changes:
+            return self.changes.get(index, self.base[index])
+        return self.base[index]
+
+    def __setitem__(self, index, value):
+        '''Change the item at the index given.'''
+        if index >= len(self.base):
+            self.extra[index - len(self.base)] = value
+        else:
+            self.changes[index] = value
+
+    def __iter__(self):
+        '''Iterate over the items in the array.'''
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, value):
+        '''Append the value given to the array.'''
+        self.extra.append(value)
+
+
+def journal_path(path):
+    '''
+    Return the path of the journal for the chain file at the path given.
+    '''
+    return path + '.journal'
+
+
+def save_chain(chain, path):
+    '''
+    Save the chain given to a chain file at the path given, with a new
+    generation, which leaves any journal it had behind.
+    The file is replaced atomically, so a crash leaves the old one intact.
+    '''
+    generation = 0
+    if os.path.isfile(path) and is_chain_file(path):
+        generation = read_generation(path) + 1
+    chain.compact()
+    chain.take_unsaved()
+    chain.journaled = True
+    chain.rebuilt = False
+    vocabulary = chain.vocabulary
+    contexts = chain.contexts
+    text = bytearray()
+    token_offsets = array('Q', [0])
+    for token_id in range(len(vocabulary)):
+        text += vocabulary[token_id].encode('utf-8')
+        token_offsets.append(len(text))
+    token_order = array('I', sorted(
+        range(len(vocabulary)),
+        key=lambda i: text[token_offsets[i]:token_offsets[i + 1]]))
+    children = sorted(((contexts.parents[node] << 32) | contexts.keys[node],
+                       node) for node in range(1, len(contexts)))
+    word_text = bytearray()
+    word_offsets = array('Q', [0])
+    posting_offsets = array('Q', [0])
+    postings = array('I')
+    for (word, found) in sorted(chain.words.items(),
+                                key=lambda item: item[0].encode('utf-8')):
+        word_text += word.encode('utf-8')
+        word_offsets.append(len(word_text))
+        postings.extend(found)
+        posting_offsets.append(len(postings))
+    offsets = array('I', chain.offsets)
+    while len(offsets) < len(contexts) + 1:
+        offsets.append(offsets[-1])
+    sections = {
+        'token_offsets': token_offsets,
+        'text': text,
+        'token_order': token_order,
+        'keys': array('I', chain.keys),
+        'parents': array('I', contexts.parents),
+        'node_keys': array('I', contexts.keys),
+        'first_children': array('I', contexts.first_children),
+        'next_siblings': array('I', contexts.next_siblings),
+        'child_index': array('Q', (key for (key, node) in children)),
+        'child_nodes': array('I', (node for (key, node) in children)),
+        'offsets': offsets,
+        'successors': array('I', chain.successors),
+        'counts': array('I', chain.counts),
+        'word_offsets': word_offsets,
+        'word_text': word_text,
+        'posting_offsets': posting_offsets,
+        'postings': postings,
+    }
+    header = HEADER.pack(MAGIC, VERSION, sys.byteorder[0].encode('ascii'),
+                         chain.order, generation, chain.decayed_at,
+                         len(vocabulary), len(contexts), len(chain.successors),
+                         len(text), len(word_offsets) - 1, len(word_text),
+                         len(postings))
+    with atomic_write(path) as f:
+        f.write(header)
+        for (name, typecode) in SECTIONS:
+            f.write(bytes(-f.tell() % 8))
+            f.write(sections[name])
+    if os.path.isfile(journal_path(path)):
+        os.remove(journal_path(path))
+
+
+def append_journal(chain, path):
+    '''
+    Append the transitions the chain given learned since it was last saved
+    to the journal of the chain file at the path given.
+    Every append is a single record with its own checksum, so a crash
+    halfway through only loses that record.
+    '''
+    unsaved = chain.take_unsaved()
+    if not unsaved:
+        return
+    generation = read_generation(path)
+    (records, end) = read_journal(path, generation)
+    payload = json.dumps({'add': unsaved}).encode('utf-8')
+    record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+    mode = 'r+b' if end else 'wb'
+    with open(journal_path(path), mode) as f:
+        if not end:
+            f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, generation))
+        else:
+            # Anything past the last good record is a torn write
+            f.seek(end)
+            f.truncate()
+        f.write(record)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def update_chain(chain, path, ratio=COMPACT_RATIO):
+    '''
+    Save the chain given to the chain file at the path given, appending
+    what it learned to the file's journal, unless there's no chain file yet,
+    the chain isn't journaled or was rebuilt, or the journal has grown past
+    the ratio given of the file's size, in which case the whole chain is
+    saved again.
+    '''
+    if (chain.rebuilt or not chain.journaled or
+            not os.path.isfile(path) or not is_chain_file(path)):
+        save_chain(chain, path)
+        return
+    append_journal(chain, path)
+    journal = journal_path(path)
+    if (os.path.isfile(journal) and
+            os.path.getsize(journal) > ratio * os.path.getsize(path)):
+        save_chain(chain, path)
+
+
+def read_generation(path):
+    '''
+    Return the generation of the chain file at the path given.
+    '''
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ChainFileException('%s is too short to be a chain file' % path)
+    return HEADER.unpack(header)[4]
+
+
+def read_journal(path, generation):
+    '''
+    Read the journal of the chain file at the path given, if it belongs to
+    the generation given.
+    Return a tuple of (records, end), where end is where the last good
+    record ends, or 0 if there's no journal to speak of.
+    '''
+    try:
+        with open(journal_path(path), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return ([], 0)
+    if len(data) < JOURNAL_HEADER.size:
+        return ([], 0)
+    (magic, journal_generation) = JOURNAL_HEADER.unpack_from(data)
+    if magic != JOURNAL_MAGIC or journal_generation != generation:
+        return ([], 0)
+    records = []
+    end = JOURNAL_HEADER.size
+    while end + RECORD_HEADER.size <= len(data):
+        (length, checksum) = RECORD_HEADER.unpack_from(data, end)
+        start = end + RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        records.append(json.loads(payload.decode('utf-8')))
+        end = start + length
+    return (records, end)
+
+
+def is_chain_file(path):
+    '''
+    Return whether the file at the path given is a chain file.
+    '''
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_chain(path):
+    '''
+    Open the chain file at the path given, returning its chain.
+    The file is mapped into memory rather than read, and the chain samples
+    straight from it; anything the chain learns afterwards, including what
+    is replayed from the file's journal, is kept in memory until it's saved
+    again.
+    '''
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buffer)
+    if len(view) < HEADER.size:
+        raise ChainFileException('%s is too short to be a chain file' % path)
+    (magic, version, byteorder, order, generation, decayed_at, tokens, nodes,
+     transitions, text_size, words, word_text_size,
+     postings) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ChainFileException('%s is not a chain file' % path)
+    if version != VERSION:
+        raise ChainFileException('%s has unsupported version %d' %
+                                 (path, version))
+    if byteorder != sys.byteorder[0].encode('ascii'):
+        raise ChainFileException('%s was written with a different byte order'
+                                 % path)
+    lengths = {
+        'token_offsets': tokens + 1,
+        'text': text_size,
+        'token_order': tokens,
+        'keys': tokens,
+        'parents': nodes,
+        'node_keys': nodes,
+        'first_children': nodes,
+        'next_siblings': nodes,
+        'child_index': nodes - 1,
+        'child_nodes': nodes - 1,
+        'offsets': nodes + 1,
+        'successors': transitions,
+        'counts': transitions,
+        'word_offsets': words + 1,
+        'word_text': word_text_size,
+        'posting_offsets': words + 1,
+        'postings': postings,
+    }
+    sections = {}
+    position = HEADER.size
+    for (name, typecode) in SECTIONS:
+        position += -position % 8
+        size = lengths[name] * array(typecode).itemsize
+        if position + size > len(view):
+            raise ChainFileException('%s is truncated' % path)
+        sections[name] = view[position:position + size].cast(typecode)
+        position += size
+    chain = MarkovChain(order)
+    chain.decayed_at = decayed_at
+    chain.vocabulary = Vocabulary(StringTable(sections['token_offsets'],
+                                              sections['text'],
+                                              sections['token_order']))
+    chain.keys = OverlayArray(sections['keys'], 'I')
+    contexts = ContextTrie(ChildTable(sections['child_index'],
+                                      sections['child_nodes']))
+    contexts.parents = OverlayArray(sections['parents'], 'I')
+    contexts.keys = OverlayArray(sections['node_keys'], 'I')
+    contexts.first_children = OverlayArray(sections['first_children'], 'I')
+    contexts.next_siblings = OverlayArray(sections['next_siblings'], 'I')
+    chain.contexts = contexts
+    # The words are stored sorted, so they're their own lookup order
+    chain.words = WordIndex(StringTable(sections['word_offsets'],
+                                        sections['word_text'], range(words)),
+                            sections['posting_offsets'], sections['postings'])
+    chain.offsets = sections['offsets']
+    chain.successors = sections['successors']
+    chain.counts = sections['counts']
+    # Whatever comes from the journal is already saved
+    for record in read_journal(path, generation)[0]:
+        chain.add_transitions(record['add'])
+    chain.journaled = True
+    return chain
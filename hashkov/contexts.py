@@ -0,0 +1,110 @@
+'''
+Provides a trie of contexts, the states of a higher order chain.
+'''
+from array import array
+
+# The id of the root of every trie, the empty context.
+ROOT = 0
+
+
+class ContextTrie(object):
+    '''
+    A trie of contexts, where a context is a sequence of token ids going
+    from the newest token to the oldest one.
+    Every node is a context, and its parent is the same context without its
+    oldest token, so contexts sharing their newest tokens share nodes, and
+    all the contexts ending in some token sit under the same node.
+    A node is stored as a few integers: its parent, its token, its first
+    child and its next sibling, plus an entry in a table hashing
+    (parent, token) to the node.
+    A trie loaded from a chain file also has a table of the nodes in the
+    file, which is only searched for nodes that aren't hashed yet.
+    '''
+    def __init__(self, table=None):
+        '''
+        Construct a trie with nothing but the root in it, on top of the
+        table of nodes given, if any.
+        '''
+        self.parents = array('I', [ROOT])
+        self.keys = array('I', [0])
+        # The root can't be anybody's child, so 0 means there's none.
+        self.first_children = array('I', [0])
+        self.next_siblings = array('I', [0])
+        self.children = {}
+        self.table = table
+
+    def __len__(self):
+        '''Return the number of nodes in the trie, root included.'''
+        return len(self.parents)
+
+    def child(self, node, key, create=False):
+        '''
+        Return the child of the node given for the token id given.
+        If there isn't one, create it if create is set, else return None.
+        '''
+        child = self.children.get((node << 32) | key)
+        if child is None and self.table is not None:
+            child = self.table.get((node << 32) | key)
+            if child is not None:
+                self.children[(node << 32) | key] = child
+        if child is None and create:
+            child = len(self.parents)
+            self.parents.append(node)
+            self.keys.append(key)
+            self.first_children.append(0)
+            self.next_siblings.append(self.first_children[node])
+            self.first_children[node] = child
+            self.children[(node << 32) | key] = child
+        return child
+
+    def find(self, context):
+        '''
+        Return the node for the context given (a sequence of token ids, newest
+        first), or None if it isn't in the trie.
+        '''
+        node = ROOT
+        for key in context:
+            node = self.child(node, key)
+            if node is None:
+                return None
+        return node
+
+    def intern(self, context):
+        '''
+        Return the node for the context given, adding it if need be.
+        '''
+        node = ROOT
+        for key in context:
+            node = self.child(node, key, True)
+        return node
+
+    def path(self, node):
+        '''
+        Return the context of the node given as a list of token ids, newest
+        first.
+        '''
+        context = []
+        while node != ROOT:
+            context.append(self.keys[node])
+            node = self.parents[node]
+        context.reverse()
+        return context
+
+    def descendants(self, node, depth):
+        '''
+        Iterate over the nodes that are depth levels below the node given.
+        '''
+        if not depth:
+            yield node
+            return
+        for child in self.children_of(node):
+            yield from self.descendants(child, depth - 1)
+
+    def children_of(self, node):
+        '''
+        Iterate over the children of the node given.
+        '''
+        child = self.first_children[node]
+        while child:
+            yield child
+            child = self.next_siblings[child]
@@ -0,0 +1,69 @@
+'''
+Keeps track of the newest tweet seen for every hashtag, so searches can
+pick up where the last run left off.
+'''
+import json
+import os
+from hashkov.files import atomic_write
+
+
+def cursors_path(path):
+    '''
+    Return the path of the cursors kept alongside the chain file at the path
+    given.
+    '''
+    return path + '.cursors'
+
+
+class SearchCursors(object):
+    '''
+    Maps hashtags (case and a leading # aside) to the id of the newest tweet
+    with them that's been seen.
+    '''
+    def __init__(self, since_ids=None):
+        '''
+        Initialize with the dict of hashtags to ids given, if any.
+        '''
+        self.since_ids = {}
+        for (hashtag, tweet_id) in (since_ids or {}).items():
+            self.advance(hashtag, tweet_id)
+
+    def get(self, hashtag):
+        '''
+        Return the id of the newest tweet seen with the hashtag given, or
+        None if there hasn't been one.
+        '''
+        return self.since_ids.get(self._key(hashtag))
+
+    def advance(self, hashtag, tweet_id):
+        '''
+        Note that the tweet with the id given has been seen with the hashtag
+        given.
+        '''
+        key = self._key(hashtag)
+        if tweet_id > self.since_ids.get(key, 0):
+            self.since_ids[key] = tweet_id
+
+    @staticmethod
+    def _key(hashtag):
+        '''Return the key the hashtag given is kept under.'''
+        return hashtag.lstrip('#').lower()
+
+
+def load_cursors(path):
+    '''
+    Load the cursors saved at the path given, or return empty ones if
+    there's nothing there.
+    '''
+    if not os.path.isfile(path):
+        return SearchCursors()
+    with open(path) as f:
+        return SearchCursors(json.load(f))
+
+
+def save_cursors(cursors, path):
+    '''
+    Save the cursors given to the path given, atomically.
+    '''
+    with atomic_write(path, 'w') as f:
+        json.dump(cursors.since_ids, f)
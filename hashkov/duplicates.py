@@ -0,0 +1,264 @@
+'''
+Filters out texts that are exact or near duplicates of ones seen before,
+like retweets and copy-pasted spam, with a set of exact hashes in front of a
+MinHash/LSH index.
+'''
+from array import array
+import hashlib
+import random
+import struct
+import sys
+import zlib
+from hashkov.files import atomic_write
+
+MAGIC = b'HKVD'
+VERSION = 2
+
+# Magic, version, byte order of the arrays, the number of values in a
+# signature, bands, shingle size and texts, the threshold, max_texts and the
+# seed.
+HEADER = struct.Struct('<4sHcxIIIQdQQ')
+
+# Keeps the mixed shingle hashes to 64 bits
+MASK = (1 << 64) - 1
+
+# Past any mixed hash, so it marks a value no shingle has picked yet
+EMPTY = 1 << 64
+
+
+class DuplicateFilter(object):
+    '''
+    Remembers the texts it lets through, and drops any text that's the same
+    as one of them once normalized, or whose MinHash signature agrees with
+    one of theirs on at least the threshold given of their values, which
+    estimates how much of the texts' shingles they share.
+    Exact duplicates (like retweets) are caught by a hash of the normalized
+    text alone, without working out a signature.
+    Signatures are worked out with one permutation: every shingle is hashed
+    once, and the hash picks which of the signature's values it's a
+    candidate for, so a signature costs one hash per shingle however many
+    values it has. Values no shingle picked are borrowed from the next one
+    that was.
+    Signatures are split into bands, and only texts that agree on a whole
+    band are compared, so checking a text doesn't get slower as more are
+    remembered. Only the max_texts most recent texts are remembered.
+    '''
+    def __init__(self, threshold=0.7, permutations=64, bands=16,
+                 max_texts=10000, shingle=5, seed=0):
+        '''
+        Construct an empty filter.
+        Signatures have the number of values given by permutations, which
+        must be a multiple of bands, and the filter uses shingles of the
+        number of characters given.
+        '''
+        if permutations % bands:
+            raise ValueError('%d permutations cannot be split into %d bands'
+                             % (permutations, bands))
+        self.threshold = threshold
+        self.permutations = permutations
+        self.bands = bands
+        self.max_texts = max_texts
+        self.shingle = shingle
+        self.seed = seed
+        rng = random.Random(seed)
+        # Mixes the crc32 of a shingle into 64 bits
+        self.mix = (rng.randrange(1, 1 << 64) | 1, rng.randrange(1 << 64))
+        # Maps an id to the signature of the text with that id, oldest first
+        self.signatures = {}
+        # Maps an id to the exact hash of the text with that id
+        self.hashes = {}
+        # Maps an exact hash to the latest id with it
+        self.exact = {}
+        # Maps a (band, values) tuple to the latest id with those values
+        self.buckets = {}
+        self.next_id = 0
+
+    def __len__(self):
+        '''Return how many texts are remembered.'''
+        return len(self.signatures)
+
+    def filter(self, texts):
+        '''
+        Iterate over the texts in the iterable given that aren't duplicates
+        of any remembered text, or of any earlier one in the iterable.
+        '''
+        for text in texts:
+            if not self.is_duplicate(text):
+                yield text
+
+    def is_duplicate(self, text):
+        '''
+        Return whether the text given is a duplicate of a remembered text,
+        remembering it if not.
+        '''
+        text = self.normalize(text)
+        exact = self.exact_hash(text)
+        if exact in self.exact:
+            return True
+        signature = self._signature(text)
+        keys = self._keys(signature)
+        for key in keys:
+            found = self.buckets.get(key)
+            if found is not None and (self.similarity(
+                    signature, self.signatures[found]) >= self.threshold):
+                return True
+        self._remember(exact, signature, keys)
+        return False
+
+    @staticmethod
+    def normalize(text):
+        '''
+        Return the text given without mentions, urls and retweet markers,
+        and without case or extra spacing, as bytes, so retweets come out
+        the same as their tweets.
+        '''
+        words = [word for word in text.lower().split()
+                 if word != 'rt' and not word.startswith('@') and
+                 not word.startswith('http')]
+        return ' '.join(words).encode('utf-8')
+
+    @staticmethod
+    def exact_hash(text):
+        '''
+        Return a 64 bit hash of the normalized text given.
+        '''
+        return int.from_bytes(hashlib.blake2b(text, digest_size=8).digest(),
+                              'little')
+
+    def signature(self, text):
+        '''
+        Return the MinHash signature of the text given, as a tuple.
+        '''
+        return self._signature(self.normalize(text))
+
+    def _signature(self, text):
+        '''
+        Return the MinHash signature of the normalized text given.
+        '''
+        (a, b) = self.mix
+        size = self.permutations
+        values = [EMPTY] * size
+        shingle = self.shingle
+        crc32 = zlib.crc32
+        for i in range(max(len(text) - shingle + 1, 1)):
+            value = (crc32(text[i:i + shingle]) * a + b) & MASK
+            # The top bits pick the slot, and the rest are the value
+            slot = (value * size) >> 64
+            if value < values[slot]:
+                values[slot] = value
+        if EMPTY in values:
+            values = self._fill(values)
+        return tuple(value & 0xffffffff for value in values)
+
+    @staticmethod
+    def _fill(values):
+        '''
+        Fill in the empty slots of the values given with the value in the
+        next slot along that isn't empty, offset by how far along it is, so
+        that texts with few shingles still get comparable signatures.
+        '''
+        size = len(values)
+        filled = list(values)
+        for slot in range(size):
+            distance = 1
+            while filled[slot] == EMPTY:
+                found = values[(slot + distance) % size]
+                if found != EMPTY:
+                    filled[slot] = (found + distance * 0x9e3779b97f4a7c15
+                                    ) & MASK
+                distance += 1
+        return filled
+
+    @staticmethod
+    def similarity(signature, other):
+        '''
+        Return the estimated similarity of the texts with the signatures
+        given, from 0 to 1.
+        '''
+        same = sum(1 for (a, b) in zip(signature, other) if a == b)
+        return same / len(signature)
+
+    def _keys(self, signature):
+        '''
+        Return the bucket keys for the signature given, one per band.
+        '''
+        rows = len(signature) // self.bands
+        return [(band, signature[band * rows:(band + 1) * rows])
+                for band in range(self.bands)]
+
+    def _remember(self, exact, signature, keys=None):
+        '''
+        Remember the exact hash and signature given, forgetting the oldest
+        text if there are too many.
+        '''
+        if keys is None:
+            keys = self._keys(signature)
+        text_id = self.next_id
+        self.next_id += 1
+        self.signatures[text_id] = signature
+        self.hashes[text_id] = exact
+        self.exact[exact] = text_id
+        for key in keys:
+            self.buckets[key] = text_id
+        while len(self.signatures) > self.max_texts:
+            oldest = next(iter(self.signatures))
+            # Newer texts may have taken the hash or buckets over
+            exact = self.hashes.pop(oldest)
+            if self.exact.get(exact) == oldest:
+                del self.exact[exact]
+            for key in self._keys(self.signatures.pop(oldest)):
+                if self.buckets.get(key) == oldest:
+                    del self.buckets[key]
+
+
+def save_filter(duplicates, path):
+    '''
+    Save the filter given to the path given, as a header followed by the
+    exact hashes of the remembered texts and their signatures, packed.
+    The file is replaced atomically.
+    '''
+    hashes = array('Q', duplicates.hashes.values())
+    signatures = array('I')
+    for signature in duplicates.signatures.values():
+        signatures.extend(signature)
+    header = HEADER.pack(MAGIC, VERSION, sys.byteorder[0].encode('ascii'),
+                         duplicates.permutations, duplicates.bands,
+                         duplicates.shingle, len(hashes),
+                         duplicates.threshold, duplicates.max_texts,
+                         duplicates.seed)
+    with atomic_write(path) as f:
+        f.write(header)
+        f.write(hashes)
+        f.write(signatures)
+
+
+def load_filter(path):
+    '''
+    Load a filter saved by save_filter from the path given.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER.size:
+        raise ValueError('%s is too short to be a duplicate filter' % path)
+    (magic, version, byteorder, permutations, bands, shingle, texts,
+     threshold, max_texts, seed) = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a duplicate filter' % path)
+    duplicates = DuplicateFilter(threshold, permutations, bands, max_texts,
+                                 shingle, seed)
+    hashes = array('Q')
+    signatures = array('I')
+    position = HEADER.size
+    hashes.frombytes(data[position:position + texts * hashes.itemsize])
+    position += texts * hashes.itemsize
+    signatures.frombytes(data[position:position + texts * permutations *
+                              signatures.itemsize])
+    if len(signatures) != texts * permutations:
+        raise ValueError('%s is truncated' % path)
+    if byteorder != sys.byteorder[0].encode('ascii'):
+        hashes.byteswap()
+        signatures.byteswap()
+    for (i, exact) in enumerate(hashes):
+        duplicates._remember(exact, tuple(
+            signatures[i * permutations:(i + 1) * permutations]))
+    return duplicates
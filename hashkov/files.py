@@ -0,0 +1,114 @@
+'''
+Helps keep things in files: writes them safely, and keeps directories of
+them within a size.
+'''
+from collections import OrderedDict
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def atomic_write(path, mode='wb', sync=True):
+    '''
+    Open a file to write what belongs at the path given to, in the mode
+    given. The file is written next to its destination and moved in place
+    once the with block is done with it, so a crash or an error halfway
+    through leaves the old file intact. Unless sync is off, the file is
+    flushed to disk before it's moved.
+    '''
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, mode) as f:
+            yield f
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DirectoryStore(object):
+    '''
+    Keeps blobs of bytes in a directory, one file per blob, evicting the
+    least recently used first once they take up more than max_size bytes.
+    Using a blob touches its file, so the order survives across runs.
+    '''
+    def __init__(self, path, max_size):
+        '''
+        Open the store in the directory at the path given, creating it if
+        need be.
+        '''
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+        # Maps the name of each file to its size, least recently used first
+        self.entries = OrderedDict()
+        found = []
+        for entry in os.scandir(path):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for (mtime, name, size) in sorted(found):
+            self.entries[name] = size
+        self.size = sum(self.entries.values())
+
+    def __len__(self):
+        '''Return how many blobs are kept.'''
+        return len(self.entries)
+
+    def __contains__(self, name):
+        '''Return whether there's a blob with the name given.'''
+        return name in self.entries
+
+    def read(self, name):
+        '''
+        Return the blob with the name given, marking it as the most recently
+        used, or None if there isn't one (or it can't be read anymore).
+        '''
+        if name not in self.entries:
+            return None
+        try:
+            with open(os.path.join(self.path, name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.size -= self.entries.pop(name)
+            return None
+        self.touch(name)
+        return data
+
+    def touch(self, name):
+        '''
+        Mark the blob with the name given as the most recently used.
+        '''
+        self.entries.move_to_end(name)
+        try:
+            os.utime(os.path.join(self.path, name))
+        except OSError:
+            pass
+
+    def write(self, name, data):
+        '''
+        Keep the blob given under the name given, evicting the least
+        recently used ones if the store grows too big.
+        '''
+        with atomic_write(os.path.join(self.path, name), sync=False) as f:
+            f.write(data)
+        self.size += len(data) - self.entries.pop(name, 0)
+        self.entries[name] = len(data)
+        while self.size > self.max_size and self.entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, name):
+        '''Stop keeping the blob with the name given, if there is one.'''
+        if name not in self.entries:
+            return
+        self.size -= self.entries.pop(name)
+        try:
+            os.remove(os.path.join(self.path, name))
+        except OSError:
+            pass
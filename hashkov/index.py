@@ -0,0 +1,64 @@
+'''
+Provides an inverted index from words to the tokens containing them.
+'''
+from array import array
+import re
+
+# What counts as a word inside a token: hashtags and plain words.
+WORD = re.compile(r'#?\w+')
+
+
+def words(text):
+    '''
+    Return the distinct words in the text given, in order.
+    '''
+    return list(dict.fromkeys(WORD.findall(text)))
+
+
+class WordIndex(object):
+    '''
+    Maps every word to the ids of the tokens it appears in.
+    Like a vocabulary, an index can sit on top of a table loaded from a
+    file: a sorted table of words, and the ids for the word at position i
+    in postings[offsets[i]:offsets[i + 1]].
+    '''
+    def __init__(self, table=(), offsets=None, postings=None):
+        '''
+        Construct an index on top of the table given, if any.
+        '''
+        self.table = table
+        self.offsets = offsets
+        self.postings = postings
+        self.extra = {}
+
+    def add(self, token_id, token):
+        '''
+        Index the token given under every word in it.
+        '''
+        for word in words(token):
+            self.extra.setdefault(word, array('I')).append(token_id)
+
+    def find(self, word):
+        '''
+        Return a list of the ids of the tokens the word given appears in.
+        '''
+        found = list(self.extra.get(word, ()))
+        position = self.table.find(word) if self.table else None
+        if position is not None:
+            found.extend(self.postings[self.offsets[position]:
+                                       self.offsets[position + 1]])
+        return found
+
+    def items(self):
+        '''
+        Iterate over (word, token ids) tuples for every word in the index.
+        '''
+        for position in range(len(self.table)):
+            word = self.table[position]
+            found = list(self.postings[self.offsets[position]:
+                                       self.offsets[position + 1]])
+            found.extend(self.extra.get(word, ()))
+            yield (word, found)
+        for (word, found) in self.extra.items():
+            if not self.table or self.table.find(word) is None:
+                yield (word, list(found))
@@ -0,0 +1,150 @@
+'''
+Instruments a text pipeline, recording how long every element takes and
+how much text goes through it.
+'''
+import random
+import time
+from hashkov.text_pipeline import CompiledPipeline, PipelineElement
+
+# How many latencies are kept per element to work out percentiles from
+SAMPLES = 4096
+
+
+class ElementStats(object):
+    '''
+    What an element in the pipeline did: how many pieces of text it was
+    called on, how long it took, how many bytes went in and out, and how
+    many pieces came out (more than one per call for splitting elements).
+    Latencies are kept in a fixed size reservoir, so percentiles are
+    estimates once there have been more calls than it holds.
+    '''
+    def __init__(self, name):
+        '''
+        Initialize empty stats for the element with the name given.
+        '''
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pieces_out = 0
+        self.latencies = []
+        self.rng = random.Random(0)
+
+    def record(self, latency, text, result):
+        '''
+        Record a call that took the latency given, in seconds, to make the
+        result given of the text given.
+        '''
+        self.calls += 1
+        self.total += latency
+        if len(self.latencies) < SAMPLES:
+            self.latencies.append(latency)
+        else:
+            i = self.rng.randrange(self.calls)
+            if i < SAMPLES:
+                self.latencies[i] = latency
+        self.bytes_in += len(text.encode('utf-8'))
+        if isinstance(result, list):
+            self.pieces_out += len(result)
+            self.bytes_out += sum(len(piece.encode('utf-8'))
+                                  for piece in result
+                                  if isinstance(piece, str))
+        else:
+            self.pieces_out += 1
+            self.bytes_out += len(result.encode('utf-8'))
+
+    def percentile(self, p):
+        '''
+        Return the latency, in seconds, below which the percentage given of
+        calls came in.
+        '''
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * p / 100),
+                             len(latencies) - 1)]
+
+    @property
+    def fan_out(self):
+        '''
+        The average number of pieces of text that came out of a call.
+        '''
+        return self.pieces_out / self.calls if self.calls else 0.0
+
+
+class PipelineStats(object):
+    '''
+    The stats of every element in an instrumented pipeline, in order.
+    '''
+    def __init__(self):
+        '''Initialize with no elements.'''
+        self.elements = []
+
+    def add(self, name):
+        '''
+        Add and return stats for an element with the name given.
+        '''
+        stats = ElementStats(name)
+        self.elements.append(stats)
+        return stats
+
+    def summary(self):
+        '''
+        Return a table of the stats, one element per line.
+        '''
+        lines = ['%-40s %8s %10s %9s %9s %9s %9s %7s' % (
+            'element', 'calls', 'total ms', 'p50 us', 'p99 us', 'in KB',
+            'out KB', 'fan-out')]
+        for stats in self.elements:
+            lines.append('%-40s %8d %10.2f %9.1f %9.1f %9.1f %9.1f %7.2f' % (
+                stats.name[:40], stats.calls, stats.total * 1e3,
+                stats.percentile(50) * 1e6, stats.percentile(99) * 1e6,
+                stats.bytes_in / 1024, stats.bytes_out / 1024,
+                stats.fan_out))
+        return '\n'.join(lines)
+
+
+class InstrumentedElement(PipelineElement):
+    '''
+    Does what the element it wraps does, recording every call in the stats
+    given.
+    '''
+    def __init__(self, element, stats):
+        '''
+        Initialize to wrap the element given.
+        '''
+        super(InstrumentedElement, self).__init__()
+        self.element = element
+        self.stats = stats
+
+    def _describe(self):
+        '''Describe the wrapped element.'''
+        return self.element._describe()
+
+    def _do_process(self, text):
+        '''Process the text with the wrapped element, timing it.'''
+        start = time.perf_counter()
+        result = self.element._do_process(text)
+        self.stats.record(time.perf_counter() - start, text, result)
+        return result
+
+
+def instrument(pipeline, stats=None):
+    '''
+    Instrument the pipeline given (its first element, or a
+    CompiledPipeline), recording what every element does in the
+    PipelineStats given, or new ones.
+    The pipeline itself is left alone.
+    Return a tuple of the CompiledPipeline to use instead, and the stats.
+    '''
+    if stats is None:
+        stats = PipelineStats()
+    if isinstance(pipeline, CompiledPipeline):
+        elements = pipeline.stages
+    else:
+        elements = pipeline.elements()
+    stages = [InstrumentedElement(element,
+                                  stats.add(' + '.join(element._describe())))
+              for element in elements]
+    return (CompiledPipeline(stages), stats)
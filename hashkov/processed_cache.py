@@ -0,0 +1,139 @@
+'''
+Caches what a text pipeline made of texts on disk, so that texts seen in
+earlier runs don't have to go down the pipeline again.
+'''
+import hashlib
+import json
+from hashkov.files import DirectoryStore
+from hashkov.pipeline_stats import InstrumentedElement
+from hashkov.text_pipeline import CompiledPipeline, Tokenizer
+
+# How many bytes of entries a cache holds by default
+DEFAULT_SIZE = 16 * 1024 * 1024
+
+
+class ProcessedCache(object):
+    '''
+    An on disk cache of pipeline results, kept in a DirectoryStore of up to
+    max_size bytes, under a hash of the text and of the pipeline's
+    description. That way entries made by differently set up pipelines
+    never mix.
+    Pipelines that hand out ids (with an interning Tokenizer) can't be
+    cached, since ids don't last from one run to the next.
+    '''
+    def __init__(self, path, pipeline, max_size=DEFAULT_SIZE):
+        '''
+        Open the cache in the directory at the path given, creating it if
+        need be, for the pipeline given (its first element, or a
+        CompiledPipeline).
+        '''
+        self.pipeline = pipeline
+        self.description = pipeline.describe().encode('utf-8')
+        if _hands_out_ids(pipeline):
+            raise ValueError('Cannot cache a pipeline that hands out ids')
+        self.store = DirectoryStore(path, max_size)
+        # Maps the key of each entry process_new made to its result, until
+        # they're committed
+        self.staged = {}
+
+    def __len__(self):
+        '''Return how many entries are in the cache.'''
+        return len(self.store)
+
+    def __contains__(self, text):
+        '''Return whether the cache has an entry for the text given.'''
+        return self.key(text) in self.store
+
+    def key(self, text):
+        '''
+        Return the key of the entry for the text given.
+        '''
+        digest = hashlib.sha256(self.description)
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.hexdigest()
+
+    def process(self, text):
+        '''
+        Return what the pipeline makes of the text given, from the cache if
+        it's there, and caching it if not.
+        '''
+        key = self.key(text)
+        result = self._get(key)
+        if result is None:
+            result = self.pipeline.process(text)
+            self._put(key, result)
+        return result
+
+    def process_stream(self, texts):
+        '''
+        Yield what the pipeline makes of every text in the iterable given,
+        like process().
+        '''
+        for text in texts:
+            yield self.process(text)
+
+    def process_new(self, texts):
+        '''
+        Yield what the pipeline makes of every text in the iterable given
+        that isn't in the cache yet. A chain trained with these only learns
+        from texts it hasn't seen before.
+        The new entries are only staged, and aren't written to the cache
+        until commit() is called, so that texts a chain learned from don't
+        count as seen unless the chain is saved.
+        '''
+        for text in texts:
+            key = self.key(text)
+            if key in self.store:
+                self.store.touch(key)
+                continue
+            if key in self.staged:
+                continue
+            result = self.pipeline.process(text)
+            self.staged[key] = result
+            yield result
+
+    def commit(self):
+        '''
+        Write the entries staged by process_new to the cache.
+        '''
+        for (key, result) in self.staged.items():
+            self._put(key, result)
+        self.staged = {}
+
+    def _get(self, key):
+        '''
+        Return the cached result with the key given, or None if there isn't
+        one.
+        '''
+        data = self.store.read(key)
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode('utf-8'))
+        except ValueError:
+            # Torn, so it'll just be worked out again
+            self.store.remove(key)
+            return None
+
+    def _put(self, key, result):
+        '''
+        Cache the result given under the key given.
+        '''
+        self.store.write(key, json.dumps(result).encode('utf-8'))
+
+def _hands_out_ids(pipeline):
+    '''
+    Return whether the pipeline given (its first element, or a
+    CompiledPipeline) has a Tokenizer that interns its tokens.
+    '''
+    if isinstance(pipeline, CompiledPipeline):
+        elements = pipeline.stages
+    else:
+        elements = pipeline.elements()
+    for element in elements:
+        if isinstance(element, InstrumentedElement):
+            element = element.element
+        if isinstance(element, Tokenizer) and element.intern is not None:
+            return True
+    return False
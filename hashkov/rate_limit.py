@@ -0,0 +1,149 @@
+'''
+Paces requests to twitter to stay within its rate limits.
+'''
+import random
+import threading
+import time
+
+# Statuses worth trying a request again for
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def _header(headers, name):
+    '''
+    Return the header with the name given as a number, or None if it's
+    missing or isn't one.
+    '''
+    try:
+        return float(headers.get(name))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    '''
+    Paces calls to an endpoint. Tokens trickle in at rate per second, up to
+    capacity, and every call takes one, waiting for it if there isn't one
+    yet. Until twitter says what the rate is, calls aren't paced, and don't
+    take tokens, since what they used is in twitter's count once it comes.
+    Waits are reserved under a lock and slept outside of it, so threads
+    sharing a bucket queue up behind each other.
+    '''
+    def __init__(self, capacity, clock=time.time):
+        '''
+        Initialize a full bucket holding up to the capacity given.
+        '''
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.rate = None
+        self.clock = clock
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def take(self):
+        '''
+        Take a token, returning how many seconds to wait before using it.
+        '''
+        with self.lock:
+            if self.rate is None:
+                return 0.0
+            self._refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def pace(self, remaining, reset):
+        '''
+        Pace calls so that the remaining calls allowed are spread over the
+        time left until the limit resets, at the time given.
+        '''
+        with self.lock:
+            self._refill()
+            window = max(reset - self.clock(), 1.0)
+            self.rate = max(remaining, 1) / window
+            self.tokens = min(self.tokens, remaining)
+
+    def _refill(self):
+        '''
+        Add the tokens that have trickled in since the last refill.
+        '''
+        now = self.clock()
+        if self.rate is not None:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter(object):
+    '''
+    Keeps a token bucket per endpoint, paced by the x-rate-limit headers of
+    twitter's responses, and works out how long to back off for before
+    trying a failed request again: exponentially longer every time, with
+    full jitter, and at least until the limit resets after a 429.
+    '''
+    def __init__(self, burst=15, retries=4, backoff=1.0, max_backoff=60.0,
+                 clock=time.time, sleep=time.sleep, rng=random):
+        '''
+        Initialize a limiter letting up to burst calls through to an
+        endpoint at once, and retrying failed requests up to retries times.
+        '''
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, endpoint):
+        '''
+        Wait until a call can be made to the endpoint given.
+        '''
+        delay = self._bucket(endpoint).take()
+        if delay > 0:
+            self.sleep(delay)
+
+    def update(self, endpoint, headers):
+        '''
+        Pace calls to the endpoint given by the rate limit headers given.
+        '''
+        remaining = _header(headers, 'x-rate-limit-remaining')
+        reset = _header(headers, 'x-rate-limit-reset')
+        if remaining is not None and reset is not None:
+            self._bucket(endpoint).pace(remaining, reset)
+
+    def should_retry(self, verb, status_code, attempt):
+        '''
+        Return whether a request with the verb given that came back with the
+        status given on the attempt given (from 0) should be tried again.
+        Only GETs are tried again after a server error, since other requests
+        might have gone through anyway.
+        '''
+        if attempt >= self.retries or status_code not in RETRY_STATUSES:
+            return False
+        return status_code == 429 or verb == 'get'
+
+    def back_off(self, attempt, status_code, headers):
+        '''
+        Wait before trying a request again after the attempt given failed
+        with the status and headers given.
+        '''
+        delay = self.rng.uniform(0, min(self.max_backoff,
+                                        self.backoff * 2 ** attempt))
+        reset = _header(headers, 'x-rate-limit-reset')
+        if status_code == 429 and reset is not None:
+            delay = max(delay, reset - self.clock())
+        if delay > 0:
+            self.sleep(delay)
+
+    def _bucket(self, endpoint):
+        '''
+        Return the bucket for the endpoint given, making it if need be.
+        '''
+        with self.lock:
+            if endpoint not in self.buckets:
+                self.buckets[endpoint] = TokenBucket(self.burst, self.clock)
+            return self.buckets[endpoint]
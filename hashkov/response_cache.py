@@ -0,0 +1,192 @@
+'''
+Caches twitter's responses for a while, so that runs close together don't
+ask it for the same things over and over.
+'''
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+import time
+from hashkov.files import DirectoryStore
+
+
+class CachedResponse(object):
+    '''
+    A successful response from the cache, with as much of a requests
+    response as the twitter client uses.
+    '''
+    status_code = 200
+
+    def __init__(self, text):
+        '''
+        Initialize a response with the body given.
+        '''
+        self.text = text
+        self.headers = {}
+
+    @property
+    def content(self):
+        '''The body, as bytes.'''
+        return self.text.encode('utf-8')
+
+    def json(self):
+        '''Return the body, parsed as json.'''
+        return json.loads(self.text)
+
+
+class MemoryBackend(object):
+    '''
+    Keeps up to max_entries responses in memory, evicting the least recently
+    used first.
+    '''
+    def __init__(self, max_entries=256):
+        '''
+        Initialize an empty backend.
+        '''
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        '''Return how many responses are kept.'''
+        return len(self.entries)
+
+    def get(self, key):
+        '''
+        Return a tuple of when the response with the key given expires and
+        its body, or None if it isn't kept.
+        '''
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, expires, text):
+        '''
+        Keep the response body given under the key given until it expires.
+        '''
+        self.entries[key] = (expires, text)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def remove(self, key):
+        '''Stop keeping the response with the key given.'''
+        self.entries.pop(key, None)
+
+
+class DiskBackend(object):
+    '''
+    Keeps responses in a DirectoryStore of up to max_size bytes, under a
+    hash of their keys.
+    '''
+    def __init__(self, path, max_size=4 * 1024 * 1024):
+        '''
+        Open the backend in the directory at the path given, creating it if
+        need be.
+        '''
+        self.store = DirectoryStore(path, max_size)
+
+    def __len__(self):
+        '''Return how many responses are kept.'''
+        return len(self.store)
+
+    def get(self, key):
+        '''
+        Return a tuple of when the response with the key given expires and
+        its body, or None if it isn't kept.
+        '''
+        name = self._name(key)
+        data = self.store.read(name)
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data.decode('utf-8'))
+        except ValueError:
+            self.store.remove(name)
+            return None
+        return (entry['expires'], entry['text'])
+
+    def put(self, key, expires, text):
+        '''
+        Keep the response body given under the key given until it expires.
+        '''
+        self.store.write(self._name(key), json.dumps(
+            {'expires': expires, 'text': text}).encode('utf-8'))
+
+    def remove(self, key):
+        '''Stop keeping the response with the key given.'''
+        self.store.remove(self._name(key))
+
+    @staticmethod
+    def _name(key):
+        '''Return the name of the file for the key given.'''
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    '''
+    Caches successful GET responses in the backend given, for as long as
+    the ttl for their endpoint says. Endpoints without a ttl aren't cached.
+    Counts hits and misses, to see how much it saves.
+    The cache can be shared between threads.
+    '''
+    def __init__(self, ttls, backend=None, clock=time.time):
+        '''
+        Initialize a cache with the dict of endpoint urls to ttls (in
+        seconds) given, keeping responses in a MemoryBackend by default.
+        '''
+        if backend is None:
+            backend = MemoryBackend()
+        self.ttls = ttls
+        self.backend = backend
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def caches(self, endpoint):
+        '''
+        Return whether responses from the endpoint given are cached.
+        '''
+        return self.ttls.get(endpoint, 0) > 0
+
+    def get(self, url, params=None):
+        '''
+        Return the cached response for a GET of the url given with the
+        params given, or None if there isn't one that's still fresh.
+        '''
+        key = self._key(url, params)
+        with self.lock:
+            entry = self.backend.get(key)
+            if entry is not None:
+                (expires, text) = entry
+                if expires > self.clock():
+                    self.hits += 1
+                    return CachedResponse(text)
+                self.backend.remove(key)
+            self.misses += 1
+        return None
+
+    def put(self, endpoint, url, params, response):
+        '''
+        Cache the response given to a GET of the url given with the params
+        given.
+        '''
+        with self.lock:
+            self.backend.put(self._key(url, params),
+                             self.clock() + self.ttls[endpoint],
+                             response.text)
+
+    def summary(self):
+        '''
+        Return a line saying how many hits and misses there have been.
+        '''
+        return 'Response cache: %d hits, %d misses' % (self.hits, self.misses)
+
+    @staticmethod
+    def _key(url, params):
+        '''
+        Return the key a GET of the url given with the params given is
+        cached under.
+        '''
+        return json.dumps([url, sorted((params or {}).items())])
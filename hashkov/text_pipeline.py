@@ -1,8 +1,13 @@
 '''
 Offers a pipeline to clean and tokenize text.
 '''
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+import os
 import re
 import string
+from hashkov import urls
 
 
 def flatten(l):
@@ -25,6 +30,17 @@ class PipelineElement(object):
     '''
     An element in the text pipeline.
     '''
+
+    # Whether the element only ever changes text within a chunk (a run of
+    # characters other than whitespace), treats the start of a chunk like the
+    # start of the text, and never adds whitespace. These elements can be
+    # fused by compile_pipeline.
+    chunk_local = False
+
+    # If set, a chunk local element leaves chunks that contain none of these
+    # characters alone.
+    triggers = None
+
     def __init__(self):
         '''
         Initialize.
@@ -45,14 +61,47 @@ class PipelineElement(object):
         Return either a list or a string, depending on whether the
         pipeline split it.
         '''
-        result = self._do_process(text)
-        if isinstance(result, list):
-            for i in range(len(result)):
-                result[i] = self.next_element.process(result[i])
-            result = flatten(result)
-        else:
-            result = self.next_element.process(result)
-        return result
+        return _run(list(self.elements()), text)
+
+    def process_stream(self, texts):
+        '''
+        Toss every text in the iterable given down the pipeline, yielding
+        what process() would return for each one as they're needed, so that
+        only one text at a time is being worked on.
+        '''
+        elements = list(self.elements())
+        for text in texts:
+            yield _run(elements, text)
+
+    def process_batch(self, texts):
+        '''
+        Toss every text in the list given down the pipeline, returning a
+        list of what process() would return for each one.
+        '''
+        return list(self.process_stream(texts))
+
+    def describe(self):
+        '''
+        Return a string describing this element and every element attached
+        after it, which is the same for any pipeline set up the same way.
+        '''
+        return ' | '.join(_describe(self.elements()))
+
+    def elements(self):
+        '''
+        Iterate over this element and every element attached after it.
+        '''
+        element = self
+        while not isinstance(element, BaseElement):
+            yield element
+            element = element.next_element
+
+    def _describe(self):
+        '''
+        Return a list of descriptions of what this element does, including
+        any setting that changes its output.
+        '''
+        return [type(self).__name__]
 
     def _do_process(self, text):
         '''
@@ -61,6 +110,45 @@ class PipelineElement(object):
         raise Exception('Need to implement method _do_process!')
 
 
+def _run(elements, text):
+    '''
+    Run the text given through the list of elements given, returning either
+    a list or a string, depending on whether any of them split it.
+    Pieces are replaced in place, so a new list is only made when an element
+    splits something.
+    '''
+    pieces = [text]
+    split = False
+    for element in elements:
+        for i in range(len(pieces)):
+            result = element._do_process(pieces[i])
+            if isinstance(result, list):
+                break
+            pieces[i] = result
+        else:
+            continue
+        # Split: everything from here on goes into a new list
+        split = True
+        done = pieces[:i]
+        done.extend(result)
+        for piece in pieces[i + 1:]:
+            result = element._do_process(piece)
+            if isinstance(result, list):
+                done.extend(result)
+            else:
+                done.append(result)
+        pieces = done
+    return pieces if split else pieces[0]
+
+
+def _describe(elements):
+    '''
+    Return a list of descriptions of the elements given.
+    '''
+    return [described for element in elements
+            for described in element._describe()]
+
+
 class BaseElement(PipelineElement):
     '''
     The base pipeline element that doesn't do anything.
@@ -93,14 +181,21 @@ class PunctuationCleaner(PipelineElement):
     '''
     Cleans up any punctuation in the text
     '''
+    chunk_local = True
+
     def __init__(self, punctuation=None):
         '''Initialize. Will take a string of punctuation if given, else will just use
            string.punctuation'''
         super(PunctuationCleaner, self).__init__()
         if punctuation is None:
             punctuation = string.punctuation
+        self.punctuation = punctuation
         self.translator = str.maketrans('', '', punctuation)
 
+    def _describe(self):
+        '''Describe the cleaner, with its punctuation.'''
+        return ['PunctuationCleaner(%r)' % self.punctuation]
+
     def _do_process(self, text):
         '''Clean up the text'''
         return text.translate(self.translator)
@@ -110,6 +205,9 @@ class MentionCleaner(PipelineElement):
     '''
     Removes any @mentions from a piece of text
     '''
+    chunk_local = True
+    triggers = '@'
+
     def __init__(self):
         '''Initialize.'''
         super(MentionCleaner, self).__init__()
@@ -125,6 +223,9 @@ class HashtagCleaner(PipelineElement):
     Turns hashtags into more kosher automatable versions.
     This is because it's forbidden to have a robot tweet to trending topics.
     '''
+    chunk_local = True
+    triggers = '#'
+
     def __init__(self):
         '''Initialize'''
         super(HashtagCleaner, self).__init__()
@@ -139,39 +240,256 @@ class HashtagCleaner(PipelineElement):
 class UrlCleaner(PipelineElement):
     '''
     Removes urls from the text.
+    Finds the urls John Gruber's regex does, with the scanner in hashkov.urls
+    so that spammy text can't make it backtrack.
     '''
+    chunk_local = True
+    # Every url has either a scheme or a dot
+    triggers = ':.'
+
     def __init__(self):
         '''Initialize'''
         super(UrlCleaner, self).__init__()
-        # This is the regex from https://gist.github.com/gruber/249502 by
-        # John Gruber. What a hero.
-        pattern = (r'(?i)\b((?:[a-z][\w-]+:(?:/{1,3}|[a-z0-9%])|www\d{0,3}[.]|'
-                   r'[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|'
-                   r'(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))'
-                   r'*\)|[^\s`!()\[\]{};:\'".,<>?«»“”‘’]))')
-        self.regex = re.compile(pattern)
 
     def _do_process(self, text):
         '''Process the text.'''
-        return self.regex.sub('', text)
+        return urls.remove_urls(text)
 
 
 class Tokenizer(PipelineElement):
     '''
     Tokenizes the input.
+    Ngrams are made of consecutive runs of words, or of every window of words
+    if they overlap.
+    Given an intern function, such as a chain's MarkovChain.intern, the
+    tokenizer hands out the ids it returns instead of the ngrams themselves,
+    so the chain can be trained with them without looking them up again.
+    It then has to be the last element in the pipeline.
     '''
-    def __init__(self, degree):
+    def __init__(self, degree, overlap=False, intern=None):
         '''
         Initialize a tokenizer.
-        Will make ngrams with the number of words given.
+        Will make ngrams with the number of words given, overlapping if asked
+        to, and intern them with the function given if any.
         '''
         super(Tokenizer, self).__init__()
         self.degree = degree
+        self.overlap = overlap
+        self.intern = intern
+
+    def _describe(self):
+        '''Describe the tokenizer, with its settings.'''
+        return ['Tokenizer(%d, overlap=%r, intern=%r)' %
+                (self.degree, self.overlap, self.intern is not None)]
 
     def _do_process(self, text):
         '''Split up the text.'''
-        retval = []
         split = text.split()
-        for i in range(0, len(split), self.degree):
-            retval.append(" ".join(split[i:i + self.degree]))
+        if self.degree == 1:
+            retval = split
+        elif self.overlap:
+            # A text shorter than an ngram still makes one
+            windows = max(len(split) - self.degree + 1, 1) if split else 0
+            retval = [" ".join(split[i:i + self.degree])
+                      for i in range(windows)]
+        else:
+            retval = [" ".join(split[i:i + self.degree])
+                      for i in range(0, len(split), self.degree)]
+        if self.intern is not None:
+            return list(map(self.intern, retval))
         return retval
+
+
+class FusedCleaner(PipelineElement):
+    '''
+    Does the work of a run of chunk local elements, optionally followed by a
+    WhitespaceCleaner, in a single pass over the text.
+    The text is split into chunks once, and each chunk only goes through the
+    elements it has triggers for, so most chunks (plain words) aren't looked
+    at again. Since the elements are chunk local, this gives the same result
+    as running them one after the other.
+    '''
+    def __init__(self, elements, whitespace=False):
+        '''
+        Initialize with the list of chunk local elements given, and whether
+        whitespace should be cleaned up after them.
+        '''
+        super(FusedCleaner, self).__init__()
+        self.elements = [(element, element.triggers) for element in elements]
+        self.whitespace = whitespace
+        self.regex = re.compile(r'(\s+)')
+
+    def _describe(self):
+        '''Describe the elements fused together.'''
+        described = _describe(element for (element, triggers) in self.elements)
+        if self.whitespace:
+            described.append(WhitespaceCleaner.__name__)
+        return described
+
+    def _do_process(self, text):
+        '''Clean up the text'''
+        if self.whitespace:
+            return self._clean_whitespace(text)
+        pieces = self.regex.split(text)
+        # Chunks are at even positions, whitespace at odd ones
+        for i in range(0, len(pieces), 2):
+            pieces[i] = self._clean(pieces[i])
+        return ''.join(pieces)
+
+    def _clean_whitespace(self, text):
+        '''
+        Clean up every chunk in the text, and turn every run of whitespace
+        left between them into a single space.
+        '''
+        result = []
+        chunks = text.split()
+        # Whitespace is only written out once the next chunk is known not to
+        # be empty, so that runs around empty chunks are merged like they
+        # would be by a WhitespaceCleaner
+        space = text[:1].isspace()
+        for (i, chunk) in enumerate(chunks):
+            if i:
+                space = True
+            chunk = self._clean(chunk)
+            if chunk:
+                if space:
+                    result.append(' ')
+                result.append(chunk)
+                space = False
+        if chunks and text[-1].isspace():
+            space = True
+        if space:
+            result.append(' ')
+        return ''.join(result)
+
+    def _clean(self, chunk):
+        '''
+        Run the chunk given through the elements it has triggers for.
+        '''
+        for (element, triggers) in self.elements:
+            if triggers is None or any(c in chunk for c in triggers):
+                chunk = element._do_process(chunk)
+        return chunk
+
+
+class CompiledPipeline(object):
+    '''
+    A pipeline compiled by compile_pipeline, which processes text like the
+    pipeline it was compiled from.
+    '''
+    def __init__(self, elements):
+        '''
+        Initialize with the list of elements to run the text through.
+        '''
+        self.stages = elements
+
+    def process(self, text):
+        '''
+        Toss the text given down the pipeline, like PipelineElement.process.
+        '''
+        return _run(self.stages, text)
+
+    def process_stream(self, texts):
+        '''
+        Toss every text in the iterable given down the pipeline, like
+        PipelineElement.process_stream.
+        '''
+        for text in texts:
+            yield _run(self.stages, text)
+
+    def process_batch(self, texts):
+        '''
+        Toss every text in the list given down the pipeline, like
+        PipelineElement.process_batch.
+        '''
+        return list(self.process_stream(texts))
+
+    def describe(self):
+        '''
+        Return a string describing the pipeline, like
+        PipelineElement.describe. It's the same as the description of the
+        pipeline it was compiled from.
+        '''
+        return ' | '.join(_describe(self.stages))
+
+
+def compile_pipeline(pipeline):
+    '''
+    Compile the pipeline starting at the element given, fusing every run of
+    chunk local elements (and a WhitespaceCleaner right after them) into a
+    single FusedCleaner. The pipeline itself is left alone.
+    Return a CompiledPipeline.
+    '''
+    stages = []
+    run = []
+    for element in pipeline.elements():
+        if element.chunk_local:
+            run.append(element)
+            continue
+        if run:
+            whitespace = isinstance(element, WhitespaceCleaner)
+            stages.append(FusedCleaner(run, whitespace))
+            run = []
+            if whitespace:
+                continue
+        stages.append(element)
+    if run:
+        stages.append(FusedCleaner(run))
+    return CompiledPipeline(stages)
+
+
+def process_parallel(pipeline, texts, chunk_size=256, workers=None,
+                     ordered=True):
+    '''
+    Toss every text in the iterable given down the pipeline given (its first
+    element, or a CompiledPipeline), fanning chunks of texts out to a pool of
+    processes, and yield what process() would return for each one.
+    Results come in the order of the texts, or as soon as their chunk is
+    done if ordered is False.
+    By default there's one worker per cpu. Only two chunks per worker are in
+    flight at a time, so the texts can be a stream too big to hold at once.
+    A Tokenizer interning into a chain would intern into the workers' copies
+    of it, so pipelines handing out ids can't be run this way.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    texts = iter(texts)
+    futures = deque()
+    with ProcessPoolExecutor(workers, initializer=_start_worker,
+                             initargs=(pipeline,)) as executor:
+        while True:
+            chunk = list(islice(texts, chunk_size))
+            if chunk:
+                futures.append(executor.submit(_process_chunk, chunk))
+                if len(futures) < 2 * workers:
+                    continue
+            elif not futures:
+                break
+            if ordered:
+                done = [futures.popleft()]
+            else:
+                (done, rest) = wait(futures, return_when=FIRST_COMPLETED)
+                futures = deque(rest)
+            for future in done:
+                for result in future.result():
+                    yield result
+
+
+# The pipeline a worker process runs its chunks through
+_worker_pipeline = None
+
+
+def _start_worker(pipeline):
+    '''
+    Set up a worker process to run chunks through the pipeline given.
+    '''
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+
+def _process_chunk(texts):
+    '''
+    Toss the texts given down the worker's pipeline, returning a list of the
+    results.
+    '''
+    return _worker_pipeline.process_batch(texts)
@@ -1,9 +1,14 @@
 '''
 Communicates with twitter.
 '''
+import queue
+import threading
 import requests as req_module
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth1
 from urllib import parse
+from urllib3.util.retry import Retry
+from hashkov.rate_limit import RateLimiter, RETRY_STATUSES
 from hashkov.text_pipeline import flatten
 
 
@@ -19,6 +24,77 @@ class TwitterException(Exception):
         super(TwitterException, self).__init__("Twitter error %d: %s" %
                                                (response.status_code,
                                                 response.text))
+        self.status_code = response.status_code
+
+
+def make_session(pool_size=10, retries=3):
+    '''
+    Return a requests session that keeps up to pool_size connections to
+    each host alive between requests, and retries GETs that fail to connect
+    up to retries times, backing off between tries. Other requests aren't
+    retried, since they might not be safe to repeat. Responses with errors
+    are left to the client's RateLimiter.
+    '''
+    retry = Retry(total=retries, backoff_factor=0.5,
+                  allowed_methods=frozenset(['GET', 'HEAD']),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = req_module.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def prefetch(iterable, size=1):
+    '''
+    Iterate over the iterable given, with a thread working up to size items
+    ahead of the caller, so that fetching the next page can overlap with
+    working on this one. Anything the iterable raises is raised to the
+    caller when it gets that far.
+    '''
+    items = queue.Queue(size)
+    stop = threading.Event()
+    # Marks the end of the items, with what was raised, if anything
+    done = object()
+
+    def fetch():
+        '''Put every item in the queue, then the end marker.'''
+        try:
+            for item in iterable:
+                if not _put(items, (None, item), stop):
+                    return
+        except Exception as e:
+            _put(items, (done, e), stop)
+        else:
+            _put(items, (done, None), stop)
+
+    thread = threading.Thread(target=fetch, daemon=True)
+    thread.start()
+    try:
+        while True:
+            (marker, item) = items.get()
+            if marker is done:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _put(items, item, stop):
+    '''
+    Put the item given in the queue given, unless stop is set first.
+    Return whether it was put.
+    '''
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
 
 
 class Twitter(object):
@@ -33,13 +109,22 @@ class Twitter(object):
     search_url = 'https://api.twitter.com/1.1/search/tweets.json'
     trends_url = 'https://api.twitter.com/1.1/trends/place.json'
 
-    def __init__(self, app_key, app_secret, requests=None, oauth_class=None):
+    def __init__(self, app_key, app_secret, requests=None, oauth_class=None,
+                 pool_size=10, retries=3, limiter=None, cache=None):
         '''
         Initialize this twitter object with the key/secret given, and use
-        the requests module given.
+        the requests module (or session) given. By default, a session made
+        by make_session with the pool size and retries given is used, so
+        connections are kept alive from one request to the next.
+        Requests are paced and retried by the RateLimiter given, or a
+        default one, and GETs are cached in the ResponseCache given, if any.
         '''
         if requests is None:
-            requests = req_module
+            requests = make_session(pool_size, retries)
+        if limiter is None:
+            limiter = RateLimiter()
+        self.limiter = limiter
+        self.cache = cache
         if oauth_class is None:
             oauth_class = OAuth1
         self.oauth_class = oauth_class
@@ -48,6 +133,22 @@ class Twitter(object):
         self.app_key = app_key
         self.oauth = self.oauth_class(app_key, client_secret=app_secret)
 
+    def close(self):
+        '''
+        Close the connections the client keeps alive, if any.
+        '''
+        close = getattr(self.requests, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        '''Use the client in a with statement, closing it at the end.'''
+        return self
+
+    def __exit__(self, *exc_info):
+        '''Close the client.'''
+        self.close()
+
     def request_request_token(self):
         '''
         Get a request token from Twitter; return a tuple containing the token
@@ -92,25 +193,72 @@ class Twitter(object):
         Search tweets by hashtag.
         Return a list of tweets.
         '''
-        if not hashtag.startswith('#'):
-            hashtag = '#' + hashtag
-        payload = {'q': hashtag}
-        if lang is not None:
-            payload['l'] = lang
-        r = self._request('get', self.search_url, auth=self.oauth,
-                          params=payload)
-        json = r.json()
-        results = json['statuses']
-        results = [i['text'] for i in results]
-        for page in range(1, pages):
-            if 'next_results' not in json['search_metadata']:
+        return [tweet for page in self.iter_pages(hashtag, pages, lang)
+                for tweet in page]
+
+    def iter_pages(self, hashtag, pages=1, lang=None, cursors=None):
+        '''
+        Search tweets by hashtag, yielding the list of tweets in every page
+        as it comes in, up to the number of pages given.
+        Given SearchCursors, only tweets newer than the newest one they have
+        for the hashtag are searched for, and they're advanced past every
+        tweet found.
+        If a page past the first can't be fetched even after retrying, the
+        pages fetched so far are all there is, rather than an error.
+        '''
+        since_id = cursors.get(hashtag) if cursors is not None else None
+        next_page = None
+        for page in range(pages):
+            try:
+                (statuses, next_page) = self._search(hashtag, lang, next_page,
+                                                     since_id)
+            except TwitterException as e:
+                if page == 0 or e.status_code not in RETRY_STATUSES:
+                    raise
+                return
+            if since_id is not None:
+                # In case the next pages don't carry since_id along
+                statuses = [i for i in statuses if i['id'] > since_id]
+            if cursors is not None:
+                for i in statuses:
+                    cursors.advance(hashtag, i['id'])
+            yield [i['text'] for i in statuses]
+            if next_page is None:
                 break
-            next_page = json['search_metadata']['next_results']
+
+    def search_page(self, hashtag, lang=None, next_page=None, since_id=None):
+        '''
+        Get a single page of tweets with the hashtag given: the first one, or
+        the one at next_page, as returned for the page before. Only tweets
+        newer than the one with since_id are searched for, if given.
+        Return a tuple of the list of tweets, and where the next page is (or
+        None if this is the last one).
+        '''
+        (statuses, next_page) = self._search(hashtag, lang, next_page,
+                                             since_id)
+        return ([i['text'] for i in statuses], next_page)
+
+    def _search(self, hashtag, lang, next_page, since_id):
+        '''
+        Get a single page of statuses, like search_page.
+        Return a tuple of the list of statuses, and where the next page is.
+        '''
+        if next_page is None:
+            if not hashtag.startswith('#'):
+                hashtag = '#' + hashtag
+            payload = {'q': hashtag}
+            if lang is not None:
+                payload['l'] = lang
+            if since_id is not None:
+                payload['since_id'] = since_id
+            r = self._request('get', self.search_url, auth=self.oauth,
+                              params=payload)
+        else:
             r = self._request('get', self.search_url + next_page,
                               auth=self.oauth)
-            json = r.json()
-            results.extend(i['text'] for i in json['statuses'])
-        return results
+        json = r.json()
+        metadata = json.get('search_metadata', {})
+        return (json['statuses'], metadata.get('next_results'))
 
     def get_trending(self, woeid):
         '''
@@ -137,12 +285,31 @@ class Twitter(object):
 
     def _request(self, verb, *args, **kwargs):
         '''
-        Do a verb request (POST or GET) with the args specified.
+        Do a verb request (POST or GET) with the args specified, paced by the
+        limiter, and tried again as it says if rate limited or if twitter is
+        having trouble. GETs come from the cache while they're fresh.
         Fail if it doesn't come back as 200.
         Else return the result.
         '''
         verb = verb.lower()
-        r = getattr(self.requests, verb)(*args, **kwargs)
-        if r.status_code != 200:
-            raise TwitterException(r)
-        return r
+        url = kwargs['url'] if 'url' in kwargs else args[0]
+        endpoint = url.split('?')[0]
+        cached = (verb == 'get' and self.cache is not None and
+                  self.cache.caches(endpoint))
+        if cached:
+            r = self.cache.get(url, kwargs.get('params'))
+            if r is not None:
+                return r
+        attempt = 0
+        while True:
+            self.limiter.wait(endpoint)
+            r = getattr(self.requests, verb)(*args, **kwargs)
+            self.limiter.update(endpoint, r.headers)
+            if r.status_code == 200:
+                if cached:
+                    self.cache.put(endpoint, url, kwargs.get('params'), r)
+                return r
+            if not self.limiter.should_retry(verb, r.status_code, attempt):
+                raise TwitterException(r)
+            self.limiter.back_off(attempt, r.status_code, r.headers)
+            attempt += 1
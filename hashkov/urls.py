@@ -0,0 +1,261 @@
+'''
+Finds urls in text in linear time.
+The urls found are the ones John Gruber's regex (GRUBER, below) finds, but
+the regex nests its quantifiers, so it can take time exponential in the
+length of a long run of punctuation or parentheses to give up on it. This
+scanner looks at every character a bounded number of times instead.
+'''
+import re
+import string
+
+# This is the regex from https://gist.github.com/gruber/249502 by John
+# Gruber. What a hero.
+GRUBER = (r'(?i)\b((?:[a-z][\w-]+:(?:/{1,3}|[a-z0-9%])|www\d{0,3}[.]|'
+          r'[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|'
+          r'(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))'
+          r'*\)|[^\s`!()\[\]{};:\'".,<>?«»“”‘’]))')
+
+# A url has no whitespace or angle brackets in it, so the text is scanned in
+# the segments between them.
+SEGMENT = re.compile(r'[^\s<>]+')
+
+# What [a-z] matches when ignoring case, which includes a few non ascii
+# letters that lowercase to ascii ones.
+LETTERS = frozenset(string.ascii_letters + 'İıſK')
+# [a-z0-9%], one of which can follow a scheme instead of slashes
+SCHEME_CHARACTERS = LETTERS | frozenset(string.digits + '%')
+# [a-z0-9.\-], which bare domain names are made of
+DOMAIN_CHARACTERS = LETTERS | frozenset(string.digits + '.-')
+# What a url can't end with
+PUNCTUATION = frozenset('`!()[]{};:\'".,<>?«»“”‘’')
+# Where a url might start: a word boundary before a character any of the
+# prefixes can start with
+START = re.compile(r'\b[%s]' %
+                   re.escape(''.join(sorted(DOMAIN_CHARACTERS))))
+
+
+def _is_word(c):
+    '''
+    Return whether the character given is matched by \\w.
+    '''
+    return c.isalnum() or c == '_'
+
+
+class _Scanner(object):
+    '''
+    Scans a segment of text for urls.
+    Group and url ends are remembered by where they start, and the runs of
+    characters urls start with are remembered until the scan moves past
+    them, so no part of the segment is looked at over and over.
+    '''
+    def __init__(self, text):
+        '''
+        Initialize to scan the text given, which has no whitespace or angle
+        brackets.
+        '''
+        self.text = text
+        self.groups = {}
+        self.ends = {}
+        self.scheme_end = 0
+        self.domain_end = 0
+
+    def spans(self):
+        '''
+        Generate the (start, end) of every url in the segment, in order.
+        '''
+        start = 0
+        while True:
+            match = START.search(self.text, start)
+            if match is None:
+                return
+            start = match.start()
+            end = self._match(start)
+            if end < 0:
+                start += 1
+            else:
+                yield (start, end)
+                start = end
+
+    def _match(self, start):
+        '''
+        Return the end of the url starting at the position given, which
+        START matches at, or -1 if there isn't one.
+        The prefixes are tried in the order the regex tries them.
+        '''
+        c = self.text[start]
+        if c in LETTERS:
+            for after in self._after_scheme(start):
+                end = self._end(after)
+                if end >= 0:
+                    return end
+            after = self._after_www(start)
+            if after >= 0:
+                end = self._end(after)
+                if end >= 0:
+                    return end
+        if c in DOMAIN_CHARACTERS:
+            after = self._after_domain(start)
+            if after >= 0:
+                return self._end(after)
+        return -1
+
+    def _after_scheme(self, start):
+        '''
+        Return where the url could go on after a scheme, like http://,
+        starting at the position given, longest first.
+        '''
+        text = self.text
+        if start + 1 >= self.scheme_end:
+            end = start + 1
+            while end < len(text) and (_is_word(text[end]) or
+                                       text[end] == '-'):
+                end += 1
+            self.scheme_end = end
+        colon = self.scheme_end
+        if colon == start + 1 or colon >= len(text) or text[colon] != ':':
+            return ()
+        slashes = 0
+        while (slashes < 3 and colon + slashes + 1 < len(text) and
+               text[colon + slashes + 1] == '/'):
+            slashes += 1
+        if slashes:
+            return range(colon + slashes + 1, colon + 1, -1)
+        if colon + 1 < len(text) and text[colon + 1] in SCHEME_CHARACTERS:
+            return (colon + 2,)
+        return ()
+
+    def _after_www(self, start):
+        '''
+        Return where the url goes on after a www., www2. and so on starting at
+        the position given, or -1 if there isn't one there.
+        '''
+        text = self.text
+        if text[start:start + 3].lower() != 'www':
+            return -1
+        i = start + 3
+        while i < min(start + 6, len(text)) and text[i].isdecimal():
+            i += 1
+        if i < len(text) and text[i] == '.':
+            return i + 1
+        return -1
+
+    def _after_domain(self, start):
+        '''
+        Return where the url goes on after a bare domain name followed by a
+        slash, like example.com/, starting at the position given, or -1 if
+        there isn't one there.
+        '''
+        text = self.text
+        if start >= self.domain_end:
+            end = start
+            while end < len(text) and text[end] in DOMAIN_CHARACTERS:
+                end += 1
+            self.domain_end = end
+        slash = self.domain_end
+        if slash >= len(text) or text[slash] != '/':
+            return -1
+        # The name has to end in a dot and two to four letters
+        letters = 0
+        while (letters < 5 and slash - letters - 1 > start and
+               text[slash - letters - 1] in LETTERS):
+            letters += 1
+        dot = slash - letters - 1
+        if 2 <= letters <= 4 and dot > start and text[dot] == '.':
+            return slash + 1
+        return -1
+
+    def _end(self, after):
+        '''
+        Return where the url whose prefix ends at the position given ends, or
+        -1 if the prefix isn't followed by a url.
+        That's past the last character or parenthesized group that can end a
+        url, as long as something comes before it.
+        '''
+        if after in self.ends:
+            return self.ends[after]
+        text = self.text
+        i = after
+        end = -1
+        while i < len(text):
+            c = text[i]
+            if c == '(':
+                group = self._group(i)
+                if group < 0:
+                    break
+                if i > after:
+                    end = group
+                i = group
+            elif c == ')':
+                break
+            else:
+                if i > after and c not in PUNCTUATION:
+                    end = i + 1
+                i += 1
+        self.ends[after] = end
+        return end
+
+    def _group(self, start):
+        '''
+        Return the end of the parenthesized group starting at the position
+        given, or -1 if it isn't one.
+        Groups can hold groups of their own, but those can't be empty or hold
+        any more.
+        '''
+        if start in self.groups:
+            return self.groups[start]
+        text = self.text
+        end = -1
+        i = start + 1
+        while i < len(text):
+            if text[i] == ')':
+                end = i + 1
+                break
+            if text[i] == '(':
+                close = i + 1
+                while close < len(text) and text[close] not in '()':
+                    close += 1
+                if (close == i + 1 or close >= len(text) or
+                        text[close] != ')'):
+                    break
+                i = close
+            i += 1
+        self.groups[start] = end
+        return end
+
+
+def _segments(text):
+    '''
+    Generate the segments of the text that might hold a url, with their
+    offsets in it.
+    '''
+    for match in SEGMENT.finditer(text):
+        segment = match.group()
+        if ':' in segment or '.' in segment:
+            yield (match.start(), segment)
+
+
+def find_urls(text):
+    '''
+    Return every url in the text, in order.
+    '''
+    if ':' not in text and '.' not in text:
+        return []
+    return [segment[start:end] for (offset, segment) in _segments(text)
+            for (start, end) in _Scanner(segment).spans()]
+
+
+def remove_urls(text):
+    '''
+    Return the text with every url in it removed.
+    '''
+    # Every url has a colon after its scheme or a dot in it
+    if ':' not in text and '.' not in text:
+        return text
+    pieces = []
+    last = 0
+    for (offset, segment) in _segments(text):
+        for (start, end) in _Scanner(segment).spans():
+            pieces.append(text[last:offset + start])
+            last = offset + end
+    pieces.append(text[last:])
+    return ''.join(pieces)
@@ -0,0 +1,58 @@
+'''
+Provides a vocabulary that hands out integer ids for tokens.
+'''
+
+
+class Vocabulary(object):
+    '''
+    Interns tokens, so that each distinct token is stored once and can be
+    referred to by a small integer id everywhere else.
+    A vocabulary can sit on top of a table of tokens loaded from a file,
+    which get the first ids. Those are only searched for when a token isn't
+    in the vocabulary's own dict, and remembered there once found.
+    '''
+    def __init__(self, table=()):
+        '''
+        Construct a vocabulary on top of the table of tokens given, if any.
+        '''
+        self.table = table
+        self.tokens = []
+        self.ids = {}
+
+    def __len__(self):
+        '''Return how many tokens have been interned.'''
+        return len(self.table) + len(self.tokens)
+
+    def __contains__(self, token):
+        '''Return whether the token given has been interned.'''
+        return self.get(token) is not None
+
+    def __getitem__(self, token_id):
+        '''Return the token with the id given.'''
+        if token_id < len(self.table):
+            return self.table[token_id]
+        return self.tokens[token_id - len(self.table)]
+
+    def get(self, token, default=None):
+        '''
+        Return the id of the token given, or the default if it has never
+        been interned.
+        '''
+        token_id = self.ids.get(token)
+        if token_id is None and self.table:
+            token_id = self.table.find(token)
+            if token_id is not None:
+                self.ids[token] = token_id
+        return default if token_id is None else token_id
+
+    def intern(self, token):
+        '''
+        Return the id of the token given, giving it a new one if it hasn't
+        been seen before.
+        '''
+        token_id = self.get(token)
+        if token_id is None:
+            token_id = len(self)
+            self.tokens.append(token)
+            self.ids[token] = token_id
+        return token_id
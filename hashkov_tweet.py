@@ -1,8 +1,14 @@
 #!/bin/env python
 from argparse import ArgumentParser
 import sys
-from hashkov.twitter import Twitter
-from hashkov.chain import MarkovChain
+from hashkov.twitter import Twitter, prefetch
+from hashkov.chain import MarkovChain, MemoryBudget
+from hashkov import chain_file
+from hashkov import cursors
+from hashkov import duplicates
+from hashkov import response_cache
+from hashkov.processed_cache import ProcessedCache
+from hashkov.pipeline_stats import instrument
 from hashkov import text_pipeline
 import os
 import pickle
@@ -27,7 +33,11 @@ def get_argument_parser():
                         help='The language to tweet in', default='en')
     parser.add_argument('-p', '--pickle', dest='pickle', default=None,
                         help='Optionally, a file to save the chain '
-                             'so that it does better next time')
+                             'so that it does better next time. Chains '
+                             'pickled by older versions are converted. '
+                             'The newest tweet trained on for every '
+                             'hashtag is kept next to it, so only newer '
+                             'ones are searched for next time')
     parser.add_argument('-w', '--woeid', dest='woeid', default=4118, type=int,
                         help='For use with -d. The woeid that the trending'
                         ' hashtag should be from')
@@ -37,6 +47,62 @@ def get_argument_parser():
     parser.add_argument('-n', '--ngram', dest='ngram', default=2, type=int,
                         help='How many words to consider as a token.'
                              ' Default 2')
+    parser.add_argument('-o', '--order', dest='order', default=1, type=int,
+                        help='How many tokens the chain should look back at'
+                             ' when picking the next one. Only used for new'
+                             ' chains. Default 1')
+    parser.add_argument('-L', '--length', dest='length', default=140,
+                        type=int, help='How many characters a tweet can'
+                                       ' have. Default 140')
+    parser.add_argument('-m', '--candidates', dest='candidates', default=1,
+                        type=int, help='How many tweets to generate, keeping'
+                                       ' the longest one. Default 1')
+    parser.add_argument('--half-life', dest='half_life', default=None,
+                        type=float, help='For use with -p. Halve what the'
+                        ' chain remembers every this many days')
+    parser.add_argument('--prune', dest='prune', default=1, type=int,
+                        help='For use with --half-life. Forget transitions'
+                             ' seen fewer than this many times after they'
+                             ' decay')
+    parser.add_argument('--max-transitions', dest='max_transitions',
+                        default=None, type=int,
+                        help='For use with -p. Forget the least used parts'
+                             ' of the chain past this many transitions')
+    parser.add_argument('-D', '--duplicates', dest='duplicates',
+                        default=None,
+                        help='Optionally, a file to remember tweets in, so'
+                             ' that retweets and copies of tweets already'
+                             ' trained on are skipped, in this run and'
+                             ' later ones. Needs -p')
+    parser.add_argument('-C', '--cache', dest='cache', default=None,
+                        help='Optionally, a directory to cache processed'
+                             ' tweets in, so that tweets trained on in'
+                             ' earlier runs are skipped. Needs -p')
+    parser.add_argument('--cache-size', dest='cache_size', default=16,
+                        type=float, help='For use with -C. How many'
+                        ' megabytes the cache can take up. Default 16')
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        help='Print how long every stage of the text'
+                             ' pipeline took, and how much text went'
+                             ' through it')
+    parser.add_argument('-P', '--prefetch', dest='prefetch', default=1,
+                        type=int, help='How many pages of tweets to fetch'
+                        ' in the background while training on the ones'
+                        ' already fetched. 0 to only fetch a page once'
+                        ' the last one has been trained on.'
+                        ' Default 1')
+    parser.add_argument('-R', '--response-cache', dest='response_cache',
+                        default=None,
+                        help='Optionally, a directory to cache twitter\'s'
+                             ' responses in, so that runs close together'
+                             ' don\'t ask it for the same things')
+    parser.add_argument('--trends-ttl', dest='trends_ttl', default=300,
+                        type=float, help='For use with -R. How many'
+                        ' seconds to cache trending hashtags for.'
+                        ' Default 300')
+    parser.add_argument('--search-ttl', dest='search_ttl', default=60,
+                        type=float, help='For use with -R. How many'
+                        ' seconds to cache search results for. Default 60')
     hashtag_parser = parser.add_mutually_exclusive_group(required=True)
     hashtag_parser.add_argument('-t', '--hashtag', dest='hashtag',
                                 help='The hashtag to tweet to')
@@ -46,36 +112,86 @@ def get_argument_parser():
     return parser
 
 
-def build_pipeline(opts):
+def build_pipeline(opts, chain=None):
     '''
-    Build a text pipeline.
+    Build a text pipeline, compiled so the cleaners share one pass, and
+    tokenizing straight into ids in the chain given, if any.
     '''
+    intern = chain.intern if chain is not None else None
     pipeline = text_pipeline.HashtagCleaner()
     (pipeline.attach_next(text_pipeline.MentionCleaner())
              .attach_next(text_pipeline.UrlCleaner())
              .attach_next(text_pipeline.WhitespaceCleaner())
-             .attach_next(text_pipeline.Tokenizer(opts.ngram)))
-    return pipeline
+             .attach_next(text_pipeline.Tokenizer(opts.ngram,
+                                                  intern=intern)))
+    return text_pipeline.compile_pipeline(pipeline)
 
 
 def get_chain(opts):
     '''
-    Build or unpickle the markov chain.
+    Build or load the markov chain.
+    Files pickled by older versions are unpickled, and will be replaced by a
+    chain file once the chain is saved.
     '''
     if opts.pickle is not None and os.path.isfile(opts.pickle):
+        if chain_file.is_chain_file(opts.pickle):
+            return chain_file.load_chain(opts.pickle)
         with open(opts.pickle, 'rb') as f:
             chain = pickle.load(f)
         return chain
-    return MarkovChain()
+    return MarkovChain(opts.order)
 
 
 def save_chain(chain, opts):
     '''
-    Pickle the markov chain given, if desired
+    Save the markov chain given to a chain file, if desired, keeping it
+    within its memory budget.
     '''
     if opts.pickle is not None:
-        with open(opts.pickle, 'wb') as f:
-            pickle.dump(chain, f)
+        half_life = None
+        if opts.half_life is not None:
+            half_life = opts.half_life * 24 * 60 * 60
+        budget = MemoryBudget(half_life, opts.prune, opts.max_transitions)
+        budget.enforce(chain)
+        chain_file.update_chain(chain, opts.pickle)
+
+
+def get_response_cache(opts):
+    '''
+    Build the cache for twitter's responses, if one is wanted.
+    '''
+    if opts.response_cache is None:
+        return None
+    ttls = {Twitter.trends_url: opts.trends_ttl,
+            Twitter.search_url: opts.search_ttl}
+    return response_cache.ResponseCache(
+        ttls, response_cache.DiskBackend(opts.response_cache))
+
+
+def get_cursors(opts):
+    '''
+    Load the search cursors kept alongside the chain file, if there's one to
+    keep them alongside. Cursors left behind by a chain that's gone aren't
+    used, since the new chain hasn't seen their tweets.
+    '''
+    if opts.pickle is None:
+        return None
+    if not os.path.isfile(opts.pickle):
+        return cursors.SearchCursors()
+    return cursors.load_cursors(cursors.cursors_path(opts.pickle))
+
+
+def get_duplicate_filter(opts):
+    '''
+    Build or load the filter for duplicate tweets, if one is wanted. A
+    filter left behind by a chain that's gone isn't used, since the new
+    chain hasn't seen its tweets.
+    '''
+    if opts.duplicates is None:
+        return None
+    if os.path.isfile(opts.pickle) and os.path.isfile(opts.duplicates):
+        return duplicates.load_filter(opts.duplicates)
+    return duplicates.DuplicateFilter()
 
 
 def get_hashtag(twitter, opts):
@@ -95,23 +211,26 @@ def generate_tweet(chain, opts, hashtag):
         if not hashtag.startswith('#'):
             hashtag = '#' + hashtag
         hashtag = hashtag.replace('#', '#_').lower()
-        keys = chain.get_possible_starts()
-        keys = [k for k in keys if hashtag in k]
-        start = random.choice(keys)
-    # 40 words should be more than enough to get us a nice tweet
-    tweet = chain.sample(20, start)
-    result = []
-    for token in tweet:
-        if len(' '.join(result)) + len(token) < 140:
-            result.append(token)
-    tweet = ' '.join(result)
-    return tweet
+        keys = chain.find_starts(hashtag)
+        if keys:
+            start = random.choice(keys)
+    # Every token takes at least a character, so this is plenty
+    candidates = chain.sample_many(opts.candidates, opts.length, start,
+                                   opts.length)
+    tweets = [' '.join(candidate).lstrip() for candidate in candidates]
+    return max(tweets, key=len)
 
 
 def main():
     parser = get_argument_parser()
     opts = parser.parse_args()
-    twitter = Twitter(opts.app_key, opts.app_secret)
+    if opts.cache is not None and opts.pickle is None:
+        parser.error('-C needs -p, to save what the cached tweets taught')
+    if opts.duplicates is not None and opts.pickle is None:
+        parser.error('-D needs -p, to save what the remembered tweets'
+                     ' taught')
+    responses = get_response_cache(opts)
+    twitter = Twitter(opts.app_key, opts.app_secret, cache=responses)
     if any([getattr(opts, i) is None for i in
             ['access_token', 'access_secret']]):
         (token, url) = twitter.request_request_token()
@@ -126,16 +245,45 @@ def main():
         print('Could not decide on a hashtag. Will now quit')
         return 1
     print("Tweeting to %s" % hashtag)
-    tweets = twitter.search_by_hashtag(hashtag, 10, opts.lang)
-    pipeline = build_pipeline(opts)
-    tweets = [pipeline.process(tweet) for tweet in tweets]
+    search_cursors = get_cursors(opts)
+    pages = twitter.iter_pages(hashtag, 10, opts.lang, search_cursors)
+    if opts.prefetch > 0:
+        pages = prefetch(pages, opts.prefetch)
+    tweets = (tweet for page in pages for tweet in page)
     chain = get_chain(opts)
-    chain.train(tweets)
+    seen = get_duplicate_filter(opts)
+    if seen is not None:
+        tweets = seen.filter(tweets)
+    pipeline = build_pipeline(opts, chain if opts.cache is None else None)
+    if opts.stats:
+        (pipeline, stats) = instrument(pipeline)
+    if opts.cache is not None:
+        # Cached tweets have been trained on already
+        cache = ProcessedCache(opts.cache, pipeline,
+                               int(opts.cache_size * 1024 * 1024))
+        chain.train(cache.process_new(tweets))
+    else:
+        chain.train_ids(pipeline.process_stream(tweets))
+    if opts.stats:
+        print(stats.summary())
+        if responses is not None:
+            print(responses.summary())
     start = ''
     tweet = generate_tweet(chain, opts, hashtag)
+    if not tweet:
+        print('Could not come up with a tweet. Will now quit')
+        return 1
     twitter.tweet(tweet)
     print("I Tweeted: %s" % tweet)
     save_chain(chain, opts)
+    if opts.cache is not None:
+        # Only now has the chain that learned the new tweets been saved
+        cache.commit()
+    if search_cursors is not None:
+        cursors.save_cursors(search_cursors,
+                             cursors.cursors_path(opts.pickle))
+    if opts.duplicates is not None:
+        duplicates.save_filter(seen, opts.duplicates)
     return 0
 
 if __name__ == '__main__':
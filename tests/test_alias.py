@@ -0,0 +1,53 @@
+from hashkov.alias import AliasTable
+import unittest
+
+
+class FixedRandom(object):
+    '''A random number generator that returns the number it's given.'''
+    def __init__(self, number):
+        self.number = number
+
+    def randrange(self, stop):
+        return self.number
+
+
+class AliasTableTest(unittest.TestCase):
+    '''
+    Test the alias table.
+    '''
+
+    def draw_all(self, table):
+        '''
+        Draw once with every possible random number and count each value.
+        '''
+        drawn = {}
+        for number in range(len(table) * table.total):
+            value = table.draw(FixedRandom(number))
+            drawn[value] = drawn.get(value, 0) + 1
+        return drawn
+
+    def test_distribution(self):
+        '''
+        Test that every value is drawn exactly in proportion to its weight.
+        '''
+        values = ['a', 'b', 'c', 'd']
+        weights = [5, 1, 3, 7]
+        drawn = self.draw_all(AliasTable(values, weights))
+        self.assertDictEqual(drawn, {'a': 20, 'b': 4, 'c': 12, 'd': 28})
+
+    def test_single_value(self):
+        '''
+        Test that a table with a single value always draws it.
+        '''
+        table = AliasTable([42], [9])
+        self.assertDictEqual(self.draw_all(table), {42: 9})
+        self.assertEqual(table.draw(), 42)
+
+    def test_draw_many(self):
+        '''
+        Test that drawing many values at once only yields known values.
+        '''
+        table = AliasTable(['a', 'b'], [1, 2])
+        drawn = table.draw_many(100)
+        self.assertEqual(len(drawn), 100)
+        self.assertTrue(set(drawn) <= {'a', 'b'})
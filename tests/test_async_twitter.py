@@ -0,0 +1,120 @@
+from hashkov.async_twitter import AsyncTwitter
+from hashkov.rate_limit import RateLimiter
+from hashkov.twitter import Twitter, TwitterException
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import Mock
+
+
+class AsyncTwitterTest(unittest.TestCase):
+    '''
+    Test the async twitter client.
+    '''
+
+    def setUp(self):
+        '''
+        Set up a client whose requests come back with a page of tweets for
+        their hashtag, and a next page for the first two pages.
+        '''
+        self.requests = Mock()
+        self.requests.get.side_effect = self.get
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+        twitter = Twitter('app_key', 'app_secret', self.requests, Mock())
+        self.twitter = AsyncTwitter(twitter, concurrency=3)
+
+    def tearDown(self):
+        self.twitter.close()
+
+    def get(self, url, auth, params=None):
+        '''
+        Pretend to search twitter, slowly, keeping track of how many
+        searches happen at once.
+        '''
+        with self.lock:
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        if params is not None:
+            (hashtag, page) = (params['q'], 1)
+        else:
+            (hashtag, page) = url.split('?')[1].split(',')
+            page = int(page)
+        r = Mock()
+        r.status_code = 200
+        if hashtag == '#missing':
+            r.status_code = 404
+        elif hashtag == '#flaky' and page > 1:
+            r.status_code = 503
+        metadata = {}
+        if page < 3:
+            metadata['next_results'] = '?%s,%d' % (hashtag, page + 1)
+        r.json.return_value = {
+            'statuses': [{'text': '%s %d' % (hashtag, page)}],
+            'search_metadata': metadata}
+        return r
+
+    def test_search_by_hashtag(self):
+        '''
+        Test that searching paginates through the results.
+        '''
+        results = asyncio.run(self.twitter.search_by_hashtag('a', 5))
+        self.assertEqual(results, ['#a 1', '#a 2', '#a 3'])
+        results = asyncio.run(self.twitter.search_by_hashtag('#a', 2))
+        self.assertEqual(results, ['#a 1', '#a 2'])
+
+    def test_search_many(self):
+        '''
+        Test that many hashtags are searched at once, but no more at a time
+        than allowed.
+        '''
+        hashtags = ['#h%d' % i for i in range(6)]
+        results = asyncio.run(self.twitter.search_many(hashtags, 3))
+        self.assertEqual(results, {hashtag: ['%s %d' % (hashtag, page)
+                                             for page in (1, 2, 3)]
+                                   for hashtag in hashtags})
+        self.assertGreater(self.most_active, 1)
+        self.assertLessEqual(self.most_active, 3)
+
+    def test_loops(self):
+        '''
+        Test that the client can be used from one event loop after another,
+        and closed at the end of the last one.
+        '''
+        hashtags = ['#h%d' % i for i in range(6)]
+        for i in range(2):
+            results = asyncio.run(self.twitter.search_many(hashtags))
+            self.assertEqual(len(results), 6)
+
+        async def search():
+            async with self.twitter as twitter:
+                return await twitter.search_many(hashtags)
+        self.assertEqual(len(asyncio.run(search())), 6)
+        with self.assertRaises(RuntimeError):
+            self.twitter.executor.submit(print)
+
+    def test_error(self):
+        '''
+        Test that failed requests raise twitter exceptions.
+        '''
+        with self.assertRaises(TwitterException):
+            asyncio.run(self.twitter.search_many(['#a', '#missing']))
+
+    def test_partial(self):
+        '''
+        Test that a later page that keeps failing ends that hashtag's search
+        with the pages fetched so far, and leaves the others alone.
+        '''
+        twitter = Twitter('app_key', 'app_secret', self.requests, Mock(),
+                          limiter=RateLimiter(retries=1, backoff=0.01))
+        client = AsyncTwitter(twitter, concurrency=3)
+        results = asyncio.run(client.search_many(['#a', '#flaky'], 3))
+        client.close()
+        self.assertEqual(results, {'#a': ['#a 1', '#a 2', '#a 3'],
+                                   '#flaky': ['#flaky 1']})
+        self.assertEqual(self.requests.get.call_count, 6)
@@ -1,4 +1,5 @@
-from hashkov.chain import MarkovChain
+from hashkov.chain import MarkovChain, MemoryBudget, train_parallel
+import pickle
 import unittest
 
 
@@ -17,12 +18,12 @@ class MarkovChainTest(unittest.TestCase):
         samples = [['a', 'b', 'c']]
         self.markov.train(samples)
         self.assertDictEqual(self.markov.memory,
-                             {'': ['a'], 'a': ['b'], 'b': ['c']})
+                             {'': {'a': 1}, 'a': {'b': 1}, 'b': {'c': 1}})
         samples = [['a', 'a', 'c', 'd', 'b']]
         self.markov.train(samples)
         self.assertDictEqual(self.markov.memory,
-                             {'': ['a', 'a'], 'a': ['b', 'a', 'c'],
-                              'b': ['c'], 'c': ['d'], 'd': ['b']})
+                             {'': {'a': 2}, 'a': {'b': 1, 'a': 1, 'c': 1},
+                              'b': {'c': 1}, 'c': {'d': 1}, 'd': {'b': 1}})
 
     def test_sample(self):
         '''
@@ -35,3 +36,202 @@ class MarkovChainTest(unittest.TestCase):
         self.assertEqual(result, 'abc')
         result = ''.join(self.markov.sample(100))
         self.assertEqual(result, 'abc')
+
+    def test_legacy_pickle(self):
+        '''
+        Test that chains pickled with a memory dict, either with a list of
+        successors or with successor counts, are converted when loaded.
+        '''
+        expected = {'': {'a': 2}, 'a': {'b': 1, 'A': 1, 'c': 1}}
+        for memory in [{'': ['a', 'a'], 'a': ['b', 'A', 'c']}, expected]:
+            loaded = MarkovChain.__new__(MarkovChain)
+            loaded.__setstate__({'memory': memory})
+            self.assertDictEqual(loaded.memory, expected)
+
+    def test_pickle(self):
+        '''
+        Test that a chain survives a round trip through pickle.
+        '''
+        self.markov.train([['a', 'B', 'c'], ['x', 'b']])
+        loaded = pickle.loads(pickle.dumps(self.markov))
+        self.assertDictEqual(loaded.memory, self.markov.memory)
+        self.assertEqual(''.join(loaded.sample(3, 'B')), 'Bc')
+
+    def test_compact(self):
+        '''
+        Test that compacting the chain doesn't change its transitions.
+        '''
+        samples = [['a', 'b', 'c'], ['a', 'a', 'C', 'd', 'b']]
+        self.markov.train(samples)
+        expected = self.markov.memory
+        self.markov.compact()
+        self.assertEqual(self.markov.pending, {})
+        self.assertDictEqual(self.markov.memory, expected)
+        self.markov.train(samples)
+        self.markov.compact()
+        self.assertEqual(self.markov.memory['a'], {'b': 2, 'a': 2, 'C': 2})
+
+    def test_sample_after_training(self):
+        '''
+        Test that training again changes what an already sampled state
+        can lead to.
+        '''
+        self.markov.train([['a', 'b']])
+        self.assertEqual(self.markov.sample(2, 'a'), ['a', 'b'])
+        self.markov.train([['x', 'A', 'c'], ['a', 'c']])
+        results = {tuple(self.markov.sample(2, 'a')) for i in range(200)}
+        self.assertSetEqual(results, {('a', 'b'), ('a', 'c')})
+
+    def test_sample_long(self):
+        '''
+        Test that sampling far more tokens than the recursion limit works.
+        '''
+        self.markov.train([['a', 'b', 'A']])
+        result = self.markov.sample(5000)
+        self.assertEqual(len(result), 5001)
+        self.assertEqual(result[:4], ['', 'a', 'b', 'A'])
+
+    def test_sample_many(self):
+        '''
+        Test that sampling many times at once walks every sample.
+        '''
+        self.markov.train([['a', 'b', 'c'], ['a', 'd']])
+        results = self.markov.sample_many(50, 10, 'a')
+        self.assertEqual(len(results), 50)
+        for result in results:
+            self.assertIn(result, [['a', 'b', 'c'], ['a', 'd']])
+        self.assertEqual(self.markov.sample_many(2, 3, 'z'), [['z'], ['z']])
+
+    def test_higher_order(self):
+        '''
+        Test that a second order chain uses the last two tokens as its state.
+        '''
+        markov = MarkovChain(2)
+        markov.train([['a', 'b', 'c'], ['x', 'B', 'd']])
+        self.assertDictEqual(markov.memory,
+                             {('', ''): {'a': 1, 'x': 1},
+                              ('', 'a'): {'b': 1}, ('a', 'b'): {'c': 1},
+                              ('', 'x'): {'B': 1}, ('x', 'b'): {'d': 1}})
+        self.assertSetEqual(set(markov.get_possible_starts()),
+                            {'', 'a', 'b', 'x'})
+        for i in range(20):
+            self.assertIn(markov.sample(5), [['', 'a', 'b', 'c'],
+                                             ['', 'x', 'B', 'd']])
+        # Starting at a token picks any of the states it's the newest of
+        results = {tuple(markov.sample(5, 'B')) for i in range(100)}
+        self.assertSetEqual(results, {('B', 'c'), ('B', 'd')})
+        self.assertEqual(markov.sample(5, 'c'), ['c'])
+
+    def test_merge(self):
+        '''
+        Test that merging chains adds up their transitions.
+        '''
+        self.markov.train([['a', 'b', 'c']])
+        other = MarkovChain()
+        other.train([['a', 'B', 'd'], ['x', 'a']])
+        self.markov.merge(other)
+        expected = MarkovChain()
+        expected.train([['a', 'b', 'c'], ['a', 'B', 'd'], ['x', 'a']])
+        self.assertDictEqual(self.markov.memory, expected.memory)
+        with self.assertRaises(ValueError):
+            self.markov.merge(MarkovChain(2))
+
+    def test_train_parallel(self):
+        '''
+        Test that training in parallel gives the same chain as training in
+        one go.
+        '''
+        samples = [['a', 'b', 'c'], ['a', 'B', 'd'], ['x', 'a'], ['d', 'c'],
+                   ['c', 'a', 'x']]
+        for order in [1, 2]:
+            expected = MarkovChain(order)
+            expected.train(samples)
+            markov = train_parallel(samples, order, shards=3, workers=2)
+            self.assertDictEqual(markov.memory, expected.memory)
+
+    def test_unsaved(self):
+        '''
+        Test that only a journaled chain keeps aside what it learns.
+        '''
+        self.markov.train([['a', 'b', 'c']])
+        self.markov.merge(train_parallel([['c', 'd']], shards=1, workers=1))
+        self.assertEqual(self.markov.unsaved, {})
+        self.assertEqual(self.markov.take_unsaved(), [])
+        self.markov.journaled = True
+        self.markov.train([['a', 'b']])
+        self.assertEqual(sorted(self.markov.take_unsaved()),
+                         [(('',), 'a', 1), (('a',), 'b', 1)])
+
+    def test_decay_prune(self):
+        '''
+        Test that decaying and pruning the chain drops rare transitions, and
+        the tokens and states only they used.
+        '''
+        self.markov.train([['a', 'b']] * 4 + [['a', 'c', 'd']] * 2)
+        self.markov.decay(0.5)
+        self.assertDictEqual(self.markov.memory,
+                             {'': {'a': 3}, 'a': {'b': 2, 'c': 1},
+                              'c': {'d': 1}})
+        self.markov.prune(2)
+        self.assertDictEqual(self.markov.memory,
+                             {'': {'a': 3}, 'a': {'b': 2}})
+        self.assertNotIn('d', self.markov.vocabulary)
+        self.assertEqual(self.markov.sample(5), ['', 'a', 'b'])
+        self.assertTrue(self.markov.rebuilt)
+
+    def test_evict(self):
+        '''
+        Test that evicting drops the states that were left the least.
+        '''
+        self.markov.train([['a', 'b', 'c']] * 3 + [['x', 'y', 'z']])
+        self.assertEqual(self.markov.size(), 6)
+        self.markov.evict(4)
+        self.assertEqual(self.markov.size(), 4)
+        self.assertDictEqual(self.markov.memory,
+                             {'': {'a': 3, 'x': 1}, 'a': {'b': 3},
+                              'b': {'c': 3}})
+
+    def test_memory_budget(self):
+        '''
+        Test that the memory budget only decays the chain once the interval
+        has passed, and keeps it within its size.
+        '''
+        budget = MemoryBudget(half_life=10, threshold=2, max_transitions=4,
+                              interval=5)
+        self.markov.train([['a', 'b', 'c']] * 4 + [['x', 'y']])
+        now = self.markov.decayed_at
+        budget.enforce(self.markov, now + 1)
+        self.assertDictEqual(self.markov.memory,
+                             {'': {'a': 4, 'x': 1}, 'a': {'b': 4},
+                              'b': {'c': 4}})
+        budget.enforce(self.markov, now + 10)
+        self.assertEqual(self.markov.decayed_at, now + 10)
+        self.assertDictEqual(self.markov.memory,
+                             {'': {'a': 2}, 'a': {'b': 2}, 'b': {'c': 2}})
+
+    def test_find_starts(self):
+        '''
+        Test that we can find the starting tokens with a word in them.
+        '''
+        self.markov.train([['#_Tag is', 'here #_tag!', 'a #_tag'],
+                           ['no #_tagging', 'x']])
+        self.assertSetEqual(set(self.markov.find_starts('#_TAG')),
+                            {'#_tag is', 'here #_tag!'})
+        self.assertEqual(self.markov.find_starts('is'), ['#_tag is'])
+        self.assertEqual(self.markov.find_starts('missing'), [])
+
+    def test_sample_budget(self):
+        '''
+        Test that sampling with a budget stops before running out of room,
+        and skips tokens that don't fit.
+        '''
+        self.markov.train([['ab', 'cd', 'ef', 'gh']])
+        self.assertEqual(self.markov.sample(10, budget=8),
+                         ['', 'ab', 'cd', 'ef'])
+        self.assertEqual(self.markov.sample(10, 'cd', budget=5),
+                         ['cd', 'ef'])
+        self.assertEqual(self.markov.sample(10, budget=1), [''])
+        self.markov.train([['x', 'averyveryverylongtoken']] +
+                          [['x', 'y']] * 9)
+        for result in self.markov.sample_many(20, 10, 'x', budget=10):
+            self.assertEqual(result, ['x', 'y'])
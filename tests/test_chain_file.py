@@ -0,0 +1,171 @@
+from hashkov.chain import MarkovChain
+from hashkov import chain_file
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+
+class ChainFileTest(unittest.TestCase):
+    '''
+    Test saving and loading chain files.
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'chain')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        '''
+        Test that a loaded chain has the transitions of the saved one.
+        '''
+        for order in [1, 2]:
+            markov = MarkovChain(order)
+            markov.train([['a', 'B', 'c'], ['b', 'a', 'ünï'], ['x', 'b']])
+            chain_file.save_chain(markov, self.path)
+            self.assertTrue(chain_file.is_chain_file(self.path))
+            loaded = chain_file.load_chain(self.path)
+            self.assertEqual(loaded.order, order)
+            self.assertDictEqual(loaded.memory, markov.memory)
+            self.assertSetEqual(set(loaded.get_possible_starts()),
+                                set(markov.get_possible_starts()))
+            self.assertEqual(loaded.sample(5, 'x')[:2], ['x', 'b'])
+            self.assertEqual(loaded.sample(5, 'ünï'), ['ünï'])
+            self.assertSetEqual(set(loaded.find_starts('b')), {'b'})
+
+    def test_train_loaded(self):
+        '''
+        Test that a loaded chain can keep learning and be saved again.
+        '''
+        markov = MarkovChain()
+        markov.train([['a', 'b', 'c']])
+        chain_file.save_chain(markov, self.path)
+        loaded = chain_file.load_chain(self.path)
+        samples = [['c', 'd', 'A', 'e']]
+        loaded.train(samples)
+        markov.train(samples)
+        self.assertDictEqual(loaded.memory, markov.memory)
+        self.assertEqual(loaded.find_starts('A'), ['a'])
+        chain_file.save_chain(loaded, self.path)
+        reloaded = chain_file.load_chain(self.path)
+        self.assertDictEqual(reloaded.memory, markov.memory)
+        self.assertSetEqual(set(reloaded.get_possible_starts()),
+                            {'', 'a', 'b', 'c', 'd'})
+        for token in ['a', 'b', 'c', 'd']:
+            self.assertEqual(reloaded.find_starts(token), [token])
+
+    def test_pickle(self):
+        '''
+        Test that a loaded chain can be pickled, and learn more afterwards.
+        '''
+        for order in [1, 2]:
+            markov = MarkovChain(order)
+            markov.train([['a', 'B', 'c'], ['b', 'a', 'ünï'], ['x', 'b']])
+            chain_file.save_chain(markov, self.path)
+            loaded = chain_file.load_chain(self.path)
+            loaded.train([['a', 'd']])
+            markov.train([['a', 'd']])
+            copied = pickle.loads(pickle.dumps(loaded))
+            self.assertDictEqual(copied.memory, markov.memory)
+            self.assertFalse(copied.journaled)
+            copied.train([['#ünï', 'b']])
+            markov.train([['#ünï', 'b']])
+            self.assertDictEqual(copied.memory, markov.memory)
+            self.assertEqual(copied.find_starts('#ünï'),
+                             markov.find_starts('#ünï'))
+
+    def test_not_chain_file(self):
+        '''
+        Test that loading something that isn't a chain file fails.
+        '''
+        with open(self.path, 'wb') as f:
+            f.write(b'definitely not a chain file, just some text')
+        self.assertFalse(chain_file.is_chain_file(self.path))
+        with self.assertRaises(chain_file.ChainFileException):
+            chain_file.load_chain(self.path)
+
+    def test_journal(self):
+        '''
+        Test that what a chain learns after being saved is journaled and
+        replayed when it's loaded.
+        '''
+        markov = MarkovChain()
+        markov.train([['a', 'b', 'c']])
+        chain_file.save_chain(markov, self.path)
+        size = os.path.getsize(self.path)
+        markov.train([['c', 'd'], ['a', 'B']])
+        chain_file.update_chain(markov, self.path, ratio=10)
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertTrue(os.path.isfile(chain_file.journal_path(self.path)))
+        loaded = chain_file.load_chain(self.path)
+        self.assertDictEqual(loaded.memory, markov.memory)
+        # Saving without learning anything else doesn't add anything
+        chain_file.update_chain(loaded, self.path, ratio=10)
+        self.assertDictEqual(chain_file.load_chain(self.path).memory,
+                             markov.memory)
+        # Once the journal is big enough it's folded into the chain file
+        loaded.train([['e', 'f']])
+        markov.train([['e', 'f']])
+        chain_file.update_chain(loaded, self.path, ratio=0)
+        self.assertFalse(os.path.isfile(chain_file.journal_path(self.path)))
+        self.assertDictEqual(chain_file.load_chain(self.path).memory,
+                             markov.memory)
+
+    def test_torn_journal(self):
+        '''
+        Test that a record torn by a crash is ignored, and that the journal
+        can be appended to afterwards.
+        '''
+        markov = MarkovChain()
+        markov.train([['a', 'b']])
+        chain_file.save_chain(markov, self.path)
+        markov.train([['b', 'c']])
+        chain_file.append_journal(markov, self.path)
+        expected = markov.memory
+        with open(chain_file.journal_path(self.path), 'ab') as f:
+            f.write(b'\x40\x00\x00\x00\x01\x02\x03\x04{"add": [[')
+        self.assertDictEqual(chain_file.load_chain(self.path).memory,
+                             expected)
+        markov.train([['c', 'd']])
+        chain_file.append_journal(markov, self.path)
+        self.assertDictEqual(chain_file.load_chain(self.path).memory,
+                             markov.memory)
+
+    def test_stale_journal(self):
+        '''
+        Test that a journal left behind by a crash while the chain file was
+        being rewritten is ignored.
+        '''
+        markov = MarkovChain()
+        markov.train([['a', 'b']])
+        chain_file.save_chain(markov, self.path)
+        markov.train([['b', 'c']])
+        chain_file.append_journal(markov, self.path)
+        journal = chain_file.journal_path(self.path)
+        shutil.copy(journal, journal + '.old')
+        chain_file.save_chain(markov, self.path)
+        os.rename(journal + '.old', journal)
+        self.assertDictEqual(chain_file.load_chain(self.path).memory,
+                             markov.memory)
+
+    def test_rebuilt(self):
+        '''
+        Test that a rebuilt chain is saved in full, along with when it was
+        decayed.
+        '''
+        markov = MarkovChain()
+        markov.train([['a', 'b']] * 2 + [['c', 'd']])
+        chain_file.save_chain(markov, self.path)
+        markov.train([['e', 'f']])
+        markov.prune(2)
+        markov.decayed_at = 1234.5
+        chain_file.update_chain(markov, self.path, ratio=10)
+        self.assertFalse(markov.rebuilt)
+        self.assertFalse(os.path.isfile(chain_file.journal_path(self.path)))
+        loaded = chain_file.load_chain(self.path)
+        self.assertDictEqual(loaded.memory, {'': {'a': 2}, 'a': {'b': 2}})
+        self.assertEqual(loaded.decayed_at, 1234.5)
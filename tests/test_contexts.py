@@ -0,0 +1,35 @@
+from hashkov.contexts import ContextTrie, ROOT
+import unittest
+
+
+class ContextTrieTest(unittest.TestCase):
+    '''
+    Test the context trie.
+    '''
+
+    def setUp(self):
+        self.trie = ContextTrie()
+
+    def test_intern(self):
+        '''
+        Test that contexts sharing their newest tokens share nodes.
+        '''
+        first = self.trie.intern([1, 2, 3])
+        second = self.trie.intern([1, 2, 4])
+        self.assertEqual(len(self.trie), 5)
+        self.assertEqual(self.trie.parents[first], self.trie.parents[second])
+        self.assertEqual(self.trie.intern([1, 2, 3]), first)
+        self.assertEqual(self.trie.find([1, 2, 4]), second)
+        self.assertIsNone(self.trie.find([2, 1]))
+        self.assertEqual(self.trie.path(second), [1, 2, 4])
+        self.assertEqual(self.trie.path(ROOT), [])
+
+    def test_descendants(self):
+        '''
+        Test that we can find every context ending in some token.
+        '''
+        contexts = [[1, 2, 3], [1, 2, 4], [1, 5, 3], [2, 1, 1]]
+        nodes = [self.trie.intern(context) for context in contexts]
+        below = self.trie.descendants(self.trie.find([1]), 2)
+        self.assertSetEqual(set(below), set(nodes[:3]))
+        self.assertEqual(list(self.trie.descendants(nodes[0], 0)), [nodes[0]])
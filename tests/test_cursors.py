@@ -0,0 +1,32 @@
+from hashkov.cursors import SearchCursors, load_cursors, save_cursors
+import os
+import tempfile
+import unittest
+
+
+class CursorsTest(unittest.TestCase):
+    '''Test the cursors module.'''
+
+    def test_advance(self):
+        '''
+        Test that cursors only move forward, and ignore case and #s.
+        '''
+        cursors = SearchCursors()
+        self.assertIsNone(cursors.get('#Tag'))
+        cursors.advance('#Tag', 5)
+        cursors.advance('tag', 3)
+        self.assertEqual(cursors.get('#tag'), 5)
+        cursors.advance('TAG', 8)
+        self.assertEqual(cursors.get('#Tag'), 8)
+
+    def test_save_load(self):
+        '''
+        Test that saved cursors load the same, and that there being none
+        saved yet is fine.
+        '''
+        cursors = SearchCursors({'#a': 1, 'b': 2})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'chain.cursors')
+            self.assertEqual(load_cursors(path).since_ids, {})
+            save_cursors(cursors, path)
+            self.assertEqual(load_cursors(path).since_ids, {'a': 1, 'b': 2})
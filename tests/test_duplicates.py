@@ -0,0 +1,53 @@
+from hashkov.duplicates import DuplicateFilter, load_filter, save_filter
+import os
+import tempfile
+import unittest
+
+
+class DuplicateFilterTest(unittest.TestCase):
+    '''Test the duplicates module.'''
+
+    def setUp(self):
+        self.duplicates = DuplicateFilter()
+
+    def test_filter(self):
+        '''
+        Test that exact and near duplicates are dropped, and nothing else is.
+        '''
+        texts = ['Win a free phone now at our store #giveaway',
+                 'RT @someone: Win a free phone now at our store #giveaway',
+                 'win a FREE phone now   at our store #giveaway http://t.co/x',
+                 'Win a free phone now at our store! #giveaway',
+                 'Something else entirely about the #giveaway',
+                 'Win a free phone now at our store #giveaway']
+        self.assertEqual(list(self.duplicates.filter(texts)),
+                         [texts[0], texts[4]])
+        self.assertEqual(len(self.duplicates), 2)
+
+    def test_bounded(self):
+        '''
+        Test that only the most recent texts are remembered.
+        '''
+        duplicates = DuplicateFilter(max_texts=2)
+        texts = ['the first text of a few', 'a second, different one',
+                 'and finally one more tweet']
+        self.assertEqual(list(duplicates.filter(texts)), texts)
+        self.assertEqual(len(duplicates), 2)
+        self.assertFalse(duplicates.is_duplicate(texts[0]))
+        self.assertTrue(duplicates.is_duplicate(texts[2]))
+        self.assertLessEqual(len(duplicates.buckets), 2 * duplicates.bands)
+
+    def test_save_load(self):
+        '''
+        Test that a saved filter still remembers its texts once loaded.
+        '''
+        self.duplicates.is_duplicate('a tweet to remember for later')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'seen')
+            save_filter(self.duplicates, path)
+            duplicates = load_filter(path)
+        self.assertEqual(duplicates.mix, self.duplicates.mix)
+        self.assertEqual(duplicates.signatures, self.duplicates.signatures)
+        self.assertTrue(duplicates.is_duplicate('A tweet to remember '
+                                                'for later'))
+        self.assertFalse(duplicates.is_duplicate('but not this one'))
@@ -0,0 +1,52 @@
+from hashkov.files import DirectoryStore, atomic_write
+import os
+import tempfile
+import unittest
+
+
+class FilesTest(unittest.TestCase):
+    '''Test the files module.'''
+
+    def test_atomic_write(self):
+        '''
+        Test that a file is only replaced once it's been written in full,
+        and that a failed write leaves the old file and nothing else.
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'file')
+            with atomic_write(path, 'w') as f:
+                f.write('old')
+            with self.assertRaises(RuntimeError):
+                with atomic_write(path, 'w') as f:
+                    f.write('new')
+                    raise RuntimeError('halfway through')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'old')
+            self.assertEqual(os.listdir(directory), ['file'])
+            with atomic_write(path, sync=False) as f:
+                f.write(b'new')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'new')
+
+    def test_directory_store(self):
+        '''
+        Test that the least recently used blobs go once the store is full,
+        in this run or the next.
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            store = DirectoryStore(directory, max_size=10)
+            for name in ['a', 'b', 'c']:
+                store.write(name, name.encode('ascii') * 3)
+            self.assertEqual(store.read('a'), b'aaa')
+            store.write('d', b'ddd')
+            self.assertNotIn('b', store)
+            self.assertEqual(sorted(os.listdir(directory)), ['a', 'c', 'd'])
+            store = DirectoryStore(directory, max_size=10)
+            self.assertEqual(store.size, 9)
+            os.utime(os.path.join(directory, 'c'), (0, 0))
+            store = DirectoryStore(directory, max_size=10)
+            store.write('e', b'ee')
+            self.assertEqual(sorted(store.entries), ['a', 'd', 'e'])
+            store.remove('a')
+            self.assertIsNone(store.read('a'))
+            self.assertEqual(len(store), 2)
@@ -0,0 +1,49 @@
+from hashkov import text_pipeline
+from hashkov.pipeline_stats import instrument
+import unittest
+
+
+class PipelineStatsTest(unittest.TestCase):
+    '''Test the pipeline_stats module.'''
+
+    def setUp(self):
+        self.pipeline = text_pipeline.WhitespaceCleaner()
+        self.pipeline.attach_next(text_pipeline.Tokenizer(2))
+
+    def test_instrument(self):
+        '''
+        Test that an instrumented pipeline gives the same results, and counts
+        what went through every element.
+        '''
+        texts = ['one  two three', 'four', '']
+        (pipeline, stats) = instrument(self.pipeline)
+        self.assertEqual(pipeline.process_batch(texts),
+                         self.pipeline.process_batch(texts))
+        self.assertEqual(pipeline.describe(), self.pipeline.describe())
+        (whitespace, tokenizer) = stats.elements
+        self.assertEqual(whitespace.name, 'WhitespaceCleaner')
+        self.assertEqual(whitespace.calls, 3)
+        self.assertEqual(whitespace.bytes_in, 18)
+        self.assertEqual(whitespace.bytes_out, 17)
+        self.assertEqual(whitespace.fan_out, 1)
+        self.assertEqual(tokenizer.calls, 3)
+        self.assertEqual(tokenizer.pieces_out, 3)
+        self.assertEqual(tokenizer.bytes_out, 16)
+        self.assertGreater(tokenizer.total, 0)
+        self.assertLessEqual(tokenizer.percentile(50),
+                             tokenizer.percentile(99))
+        self.assertEqual(len(stats.summary().splitlines()), 3)
+
+    def test_compiled(self):
+        '''
+        Test that the stages of a compiled pipeline are instrumented, with
+        the names of the elements they fuse.
+        '''
+        cleaner = text_pipeline.MentionCleaner()
+        cleaner.attach_next(self.pipeline)
+        compiled = text_pipeline.compile_pipeline(cleaner)
+        (pipeline, stats) = instrument(compiled)
+        self.assertEqual(pipeline.process('a @b c'), ['a c'])
+        self.assertEqual([element.name for element in stats.elements],
+                         ['MentionCleaner + WhitespaceCleaner',
+                          'Tokenizer(2, overlap=False, intern=False)'])
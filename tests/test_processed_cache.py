@@ -0,0 +1,86 @@
+from hashkov import text_pipeline
+from hashkov.pipeline_stats import instrument
+from hashkov.processed_cache import ProcessedCache
+import os
+import tempfile
+import unittest
+
+
+class ProcessedCacheTest(unittest.TestCase):
+    '''Test the processed_cache module.'''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cache')
+        self.pipeline = text_pipeline.WhitespaceCleaner()
+        self.pipeline.attach_next(text_pipeline.Tokenizer(2))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_process(self):
+        '''
+        Test that results are the pipeline's, and come from the cache the
+        second time around, in this run or the next.
+        '''
+        texts = ['some  text to tokenize', 'more text']
+        cache = ProcessedCache(self.path, self.pipeline)
+        expected = self.pipeline.process_batch(texts)
+        self.assertEqual(list(cache.process_stream(texts)), expected)
+        self.assertEqual(len(cache), 2)
+        cache = ProcessedCache(self.path, self.pipeline)
+        self.assertIn(texts[0], cache)
+        cache.pipeline = None
+        self.assertEqual(list(cache.process_stream(texts)), expected)
+
+    def test_process_new(self):
+        '''
+        Test that only texts that weren't cached yet are processed, and that
+        they're only cached once committed.
+        '''
+        cache = ProcessedCache(self.path, self.pipeline)
+        self.assertEqual(list(cache.process_new(['a b', 'c', 'c'])),
+                         [['a b'], ['c']])
+        self.assertEqual(len(ProcessedCache(self.path, self.pipeline)), 0)
+        cache.commit()
+        self.assertEqual(list(cache.process_new(['c', 'd e', 'a b'])),
+                         [['d e']])
+        cache = ProcessedCache(self.path, self.pipeline)
+        self.assertEqual(list(cache.process_new(['c', 'd e', 'a b'])),
+                         [['d e']])
+
+    def test_configuration(self):
+        '''
+        Test that differently set up pipelines don't share entries, and that
+        a compiled pipeline shares them with the one it was compiled from.
+        '''
+        cache = ProcessedCache(self.path, self.pipeline)
+        cache.process('a b c')
+        pipeline = text_pipeline.WhitespaceCleaner()
+        pipeline.attach_next(text_pipeline.Tokenizer(3))
+        self.assertNotIn('a b c', ProcessedCache(self.path, pipeline))
+        compiled = text_pipeline.compile_pipeline(self.pipeline)
+        self.assertIn('a b c', ProcessedCache(self.path, compiled))
+        pipeline = text_pipeline.WhitespaceCleaner()
+        pipeline.attach_next(text_pipeline.Tokenizer(2,
+                                                     intern=lambda token: 0))
+        self.assertRaises(ValueError, ProcessedCache, self.path, pipeline)
+        compiled = text_pipeline.compile_pipeline(pipeline)
+        self.assertRaises(ValueError, ProcessedCache, self.path, compiled)
+        (instrumented, stats) = instrument(pipeline)
+        self.assertRaises(ValueError, ProcessedCache, self.path,
+                          instrumented)
+
+    def test_eviction(self):
+        '''
+        Test that the least recently used entries go once the cache is full.
+        '''
+        cache = ProcessedCache(self.path, self.pipeline, max_size=30)
+        for text in ['one', 'two', 'three']:
+            cache.process(text)
+        cache.process('one')
+        cache.process('four')
+        self.assertLessEqual(cache.store.size, 30)
+        self.assertEqual(len(os.listdir(self.path)), len(cache))
+        self.assertIn('one', cache)
+        self.assertNotIn('two', cache)
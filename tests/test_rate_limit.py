@@ -0,0 +1,70 @@
+from hashkov.rate_limit import RateLimiter, TokenBucket
+import random
+import unittest
+
+
+class Clock(object):
+    '''A clock that only moves when something sleeps.'''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class RateLimitTest(unittest.TestCase):
+    '''Test the rate_limit module.'''
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_bucket(self):
+        '''
+        Test that a bucket lets a burst through, then paces calls to spread
+        what's left of the limit until it resets.
+        '''
+        bucket = TokenBucket(2, self.clock)
+        self.assertEqual([bucket.take() for i in range(100)], [0] * 100)
+        # Calls made before the rate was known aren't held against it
+        bucket.pace(10, self.clock() + 100)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 10)
+        self.assertAlmostEqual(bucket.take(), 20)
+        self.clock.sleep(20)
+        self.assertAlmostEqual(bucket.take(), 10)
+        self.clock.sleep(10)
+        # Out of calls: wait for the reset
+        bucket.pace(0, self.clock() + 300)
+        self.assertAlmostEqual(bucket.take(), 300)
+
+    def test_limiter(self):
+        '''
+        Test that the limiter paces endpoints separately, and backs off
+        exponentially, until the reset after a 429.
+        '''
+        limiter = RateLimiter(burst=1, retries=2, clock=self.clock,
+                              sleep=self.clock.sleep, rng=random.Random(0))
+        headers = {'x-rate-limit-remaining': '4',
+                   'x-rate-limit-reset': str(self.clock() + 40)}
+        limiter.wait('a')
+        limiter.update('a', headers)
+        limiter.wait('b')
+        limiter.wait('a')
+        self.assertEqual(self.clock(), 1000)
+        limiter.wait('a')
+        self.assertAlmostEqual(self.clock(), 1010)
+        self.assertTrue(limiter.should_retry('get', 503, 1))
+        self.assertFalse(limiter.should_retry('get', 503, 2))
+        self.assertFalse(limiter.should_retry('post', 503, 0))
+        self.assertTrue(limiter.should_retry('post', 429, 0))
+        self.assertFalse(limiter.should_retry('get', 404, 0))
+        limiter.back_off(3, 503, {})
+        self.assertLessEqual(self.clock(), 1018)
+        start = self.clock()
+        limiter.back_off(0, 429, {'x-rate-limit-reset': str(start + 60)})
+        self.assertAlmostEqual(self.clock(), start + 60)
@@ -0,0 +1,68 @@
+from hashkov.response_cache import (DiskBackend, MemoryBackend,
+                                    ResponseCache)
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+
+class ResponseCacheTest(unittest.TestCase):
+    '''Test the response_cache module.'''
+
+    def setUp(self):
+        self.now = 100.0
+        self.response = Mock()
+        self.response.text = '{"a": [1, 2]}'
+
+    def clock(self):
+        return self.now
+
+    def check_cache(self, backend):
+        '''
+        Test that responses are cached for their endpoint's ttl, counting
+        hits and misses.
+        '''
+        cache = ResponseCache({'http://a': 10, 'http://b': 0}, backend,
+                              self.clock)
+        self.assertTrue(cache.caches('http://a'))
+        self.assertFalse(cache.caches('http://b'))
+        self.assertFalse(cache.caches('http://c'))
+        self.assertIsNone(cache.get('http://a', {'x': 1}))
+        cache.put('http://a', 'http://a', {'x': 1}, self.response)
+        self.now += 5
+        self.assertEqual(cache.get('http://a', {'x': 1}).json(),
+                         {'a': [1, 2]})
+        self.assertIsNone(cache.get('http://a', {'x': 2}))
+        self.now += 5
+        self.assertIsNone(cache.get('http://a', {'x': 1}))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+        self.assertEqual(len(backend), 0)
+
+    def test_memory(self):
+        '''
+        Test caching in memory, and that only so many responses are kept.
+        '''
+        self.check_cache(MemoryBackend())
+        backend = MemoryBackend(max_entries=2)
+        for key in 'abc':
+            backend.put(key, 1, key)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('c'), (1, 'c'))
+
+    def test_disk(self):
+        '''
+        Test caching on disk, across instances, and that only so many bytes
+        of responses are kept.
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_cache(DiskBackend(directory))
+            backend = DiskBackend(directory, max_size=150)
+            for key in 'abc':
+                backend.put(key, 1, key * 20)
+            backend.get('a')
+            backend.put('d', 1, 'd' * 20)
+            backend = DiskBackend(directory, max_size=150)
+            self.assertEqual(backend.get('a'), (1, 'a' * 20))
+            self.assertIsNone(backend.get('b'))
+            self.assertLessEqual(backend.store.size, 150)
+            self.assertEqual(len(os.listdir(directory)), len(backend))
@@ -1,3 +1,4 @@
+from hashkov.chain import MarkovChain
 from hashkov import text_pipeline
 import unittest
 
@@ -87,3 +88,98 @@ class TextPipelineTest(unittest.TestCase):
         cleaner.attach_next(text_pipeline.WhitespaceCleaner())
         result = cleaner.process(text)
         self.assertEqual(result, expected)
+
+    def test_process_stream(self):
+        '''
+        Test that streaming texts through the pipeline gives the same results
+        as processing them one by one, and only as they're needed.
+        '''
+        texts = ['Some  text, with words', 'more\twords', '']
+        cleaner = text_pipeline.WhitespaceCleaner()
+        (cleaner.
+         attach_next(text_pipeline.PunctuationCleaner()).
+         attach_next(text_pipeline.Tokenizer(2)))
+        expected = [cleaner.process(text) for text in texts]
+        self.assertEqual(expected, [['Some text', 'with words'],
+                                    ['more words'], []])
+        self.assertEqual(cleaner.process_batch(texts), expected)
+        consumed = []
+
+        def generate():
+            for text in texts:
+                consumed.append(text)
+                yield text
+        stream = cleaner.process_stream(generate())
+        self.assertEqual(next(stream), expected[0])
+        self.assertEqual(consumed, texts[:1])
+        self.assertEqual(list(stream), expected[1:])
+
+    def test_compile_pipeline(self):
+        '''
+        Test that a compiled pipeline fuses the cleaners, and gives the same
+        results as the pipeline it was compiled from.
+        '''
+        texts = ['#Tag with @someone and http://example.com/a  links',
+                 'RT @user: check this #out', '@only', '  @front back  ',
+                 'a @x b', 'email@example.com/path #_hash', '', '   ',
+                 "trail #ing\t@mention\n", '(www.example.com) #123 #a1']
+        pipeline = text_pipeline.HashtagCleaner()
+        (pipeline.attach_next(text_pipeline.MentionCleaner())
+                 .attach_next(text_pipeline.UrlCleaner())
+                 .attach_next(text_pipeline.WhitespaceCleaner())
+                 .attach_next(text_pipeline.Tokenizer(2))
+                 .attach_next(text_pipeline.PunctuationCleaner()))
+        compiled = text_pipeline.compile_pipeline(pipeline)
+        self.assertEqual([type(stage) for stage in compiled.stages],
+                         [text_pipeline.FusedCleaner, text_pipeline.Tokenizer,
+                          text_pipeline.FusedCleaner])
+        self.assertEqual(compiled.process_batch(texts),
+                         [pipeline.process(text) for text in texts])
+        # Without a whitespace cleaner, whitespace is left as it was
+        cleaner = text_pipeline.MentionCleaner()
+        cleaner.attach_next(text_pipeline.HashtagCleaner())
+        compiled = text_pipeline.compile_pipeline(cleaner)
+        self.assertEqual(list(compiled.process_stream(texts)),
+                         [cleaner.process(text) for text in texts])
+
+    def test_process_parallel(self):
+        '''
+        Test that processing texts in parallel gives the same results as
+        processing them one by one, in order unless asked otherwise.
+        '''
+        texts = ['Text number %d, with #tags @and http://x.com/%d urls' %
+                 (i, i) for i in range(50)]
+        pipeline = text_pipeline.HashtagCleaner()
+        (pipeline.attach_next(text_pipeline.UrlCleaner())
+                 .attach_next(text_pipeline.WhitespaceCleaner())
+                 .attach_next(text_pipeline.Tokenizer(2)))
+        expected = pipeline.process_batch(texts)
+        result = text_pipeline.process_parallel(pipeline, iter(texts),
+                                                chunk_size=7, workers=2)
+        self.assertEqual(list(result), expected)
+        compiled = text_pipeline.compile_pipeline(pipeline)
+        result = text_pipeline.process_parallel(compiled, texts, chunk_size=3,
+                                                workers=2, ordered=False)
+        self.assertEqual(sorted(result), sorted(expected))
+        self.assertEqual(list(text_pipeline.process_parallel(pipeline, [])),
+                         [])
+
+    def test_tokenizer_modes(self):
+        '''
+        Test overlapping ngrams, and tokenizing into ids.
+        '''
+        tokenizer = text_pipeline.Tokenizer(2, overlap=True)
+        self.assertEqual(tokenizer.process('a b c d'), ['a b', 'b c', 'c d'])
+        self.assertEqual(tokenizer.process('a'), ['a'])
+        self.assertEqual(tokenizer.process(' '), [])
+        self.assertEqual(text_pipeline.Tokenizer(3).process('a b c d'),
+                         ['a b c', 'd'])
+        chain = MarkovChain()
+        tokenizer = text_pipeline.Tokenizer(1, intern=chain.intern)
+        ids = tokenizer.process('A b A')
+        self.assertEqual(ids, [chain.intern('A'), chain.intern('b'),
+                               chain.intern('A')])
+        chain.train_ids([ids])
+        expected = MarkovChain()
+        expected.train([['A', 'b', 'A']])
+        self.assertDictEqual(chain.memory, expected.memory)
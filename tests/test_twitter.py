@@ -1,4 +1,7 @@
-from hashkov.twitter import Twitter, TwitterException
+from hashkov.twitter import Twitter, TwitterException, prefetch
+from hashkov.cursors import SearchCursors
+from hashkov.response_cache import ResponseCache
+from hashkov.rate_limit import RateLimiter
 import unittest
 from unittest.mock import Mock, ANY, call
 from urllib import parse
@@ -249,3 +252,116 @@ class TwitterTest(unittest.TestCase):
             self.fail('Did not throw on http error')
         except TwitterException:
             pass
+
+    def test_session(self):
+        '''
+        Test that by default a pooled session that retries GETs is used.
+        '''
+        with Twitter(self.app_key, self.app_secret,
+                     oauth_class=self.oauth_class, pool_size=4,
+                     retries=2) as twitter:
+            adapter = twitter.requests.get_adapter(twitter.search_url)
+            self.assertEqual(adapter._pool_maxsize, 4)
+            self.assertEqual(adapter.max_retries.total, 2)
+            self.assertIn('GET', adapter.max_retries.allowed_methods)
+            self.assertNotIn('POST', adapter.max_retries.allowed_methods)
+        self.twitter.close()
+        self.requests.close.assert_called_once_with()
+
+    def test_iter_pages(self):
+        '''
+        Test that pages are yielded one at a time, as they're fetched.
+        '''
+        r = Mock()
+        r.status_code = 200
+        r.json.return_value = {'statuses': [{'text': 'a'}, {'text': 'b'}],
+                               'search_metadata': {'next_results': '?p'}}
+        self.requests.get.return_value = r
+        pages = self.twitter.iter_pages('#tag', 3)
+        self.assertEqual(next(pages), ['a', 'b'])
+        self.assertEqual(self.requests.get.call_count, 1)
+        self.assertEqual(list(pages), [['a', 'b'], ['a', 'b']])
+        self.assertEqual(self.requests.get.call_count, 3)
+
+    def test_prefetch(self):
+        '''
+        Test that prefetching gives the same items, and raises what the
+        iterable raises when it gets there.
+        '''
+        self.assertEqual(list(prefetch(iter(range(10)), 2)), list(range(10)))
+
+        def failing():
+            yield 1
+            raise ValueError('failed')
+        items = prefetch(failing())
+        self.assertEqual(next(items), 1)
+        self.assertRaises(ValueError, next, items)
+
+    def test_rate_limited(self):
+        '''
+        Test that rate limited requests are tried again, and that a search
+        that runs out of tries past the first page gives what it has.
+        '''
+        limiter = RateLimiter(retries=2, sleep=Mock())
+        twitter = Twitter(self.app_key, self.app_secret, self.requests,
+                          self.oauth_class, limiter=limiter)
+        page = Mock()
+        page.status_code = 200
+        page.headers = {}
+        page.json.return_value = {'statuses': [{'text': 'a'}],
+                                  'search_metadata': {'next_results': '?p'}}
+        limited = Mock()
+        limited.status_code = 429
+        limited.headers = {}
+        self.requests.get.side_effect = [limited, page, limited, page,
+                                         limited, limited, limited]
+        self.assertEqual(twitter.search_by_hashtag('#tag', 5), ['a', 'a'])
+        self.assertEqual(self.requests.get.call_count, 7)
+        self.assertEqual(limiter.sleep.call_count, 4)
+        self.requests.get.side_effect = [limited] * 3
+        with self.assertRaises(TwitterException) as raised:
+            twitter.search_by_hashtag('#tag', 5)
+        self.assertEqual(raised.exception.status_code, 429)
+
+    def test_search_cursors(self):
+        '''
+        Test that searching with cursors only asks for, and gives, tweets
+        newer than the cursor, and advances it past them.
+        '''
+        r = Mock()
+        r.status_code = 200
+        r.json.return_value = {'statuses': [{'text': 'new', 'id': 12},
+                                            {'text': 'old', 'id': 10}],
+                               'search_metadata': {}}
+        self.requests.get.return_value = r
+        cursors = SearchCursors({'tag': 10})
+        pages = list(self.twitter.iter_pages('#Tag', 2, cursors=cursors))
+        self.assertEqual(pages, [['new']])
+        self.requests.get.assert_called_once_with(
+            ANY, auth=ANY, params={'q': '#Tag', 'since_id': 10})
+        self.assertEqual(cursors.get('tag'), 12)
+
+    def test_response_cache(self):
+        '''
+        Test that cached GETs aren't requested again while they're fresh,
+        and that POSTs never come from the cache.
+        '''
+        cache = ResponseCache({Twitter.trends_url: 60,
+                               Twitter.tweet_url: 60})
+        twitter = Twitter(self.app_key, self.app_secret, self.requests,
+                          self.oauth_class, cache=cache)
+        r = Mock()
+        r.status_code = 200
+        r.text = json.dumps([{'trends': [{'name': '#a'}, {'name': 'b'}]}])
+        r.json.return_value = json.loads(r.text)
+        self.requests.get.return_value = r
+        self.assertEqual(twitter.get_trending(1), ['#a'])
+        self.assertEqual(twitter.get_trending(1), ['#a'])
+        self.assertEqual(self.requests.get.call_count, 1)
+        twitter.get_trending(2)
+        self.assertEqual(self.requests.get.call_count, 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.requests.post.return_value = r
+        twitter.tweet('a')
+        twitter.tweet('a')
+        self.assertEqual(self.requests.post.call_count, 2)
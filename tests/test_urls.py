@@ -0,0 +1,60 @@
+from hashkov import urls
+import random
+import re
+import unittest
+
+
+class UrlsTest(unittest.TestCase):
+    '''Test the urls module.'''
+
+    def test_find_urls(self):
+        '''
+        Test that urls of every shape are found, and nothing else is.
+        '''
+        text = ('see http://www.twitter.com/ and https://en.wikipedia.org/'
+                'wiki/Foo_(bar) or www2.example.com, example.co.uk/a/b. '
+                'mailto:someone (http://x.com/a) not.a.url '
+                'WWW.SHOUTING.COM/ <http://tag.org/x>')
+        expected = ['http://www.twitter.com/',
+                    'https://en.wikipedia.org/wiki/Foo_(bar)',
+                    'www2.example.com', 'example.co.uk/a/b', 'mailto:someone',
+                    'http://x.com/a', 'WWW.SHOUTING.COM/',
+                    'http://tag.org/x']
+        self.assertEqual(urls.find_urls(text), expected)
+        self.assertEqual(urls.find_urls('no urls here'), [])
+
+    def test_remove_urls(self):
+        '''
+        Test that urls are removed, and everything around them is kept.
+        '''
+        text = 'a http://x.com/(a(b)c) b, www.y.org! c'
+        self.assertEqual(urls.remove_urls(text), 'a  b, ! c')
+        text = 'Nothing to see here'
+        self.assertIs(urls.remove_urls(text), text)
+
+    def test_same_as_regex(self):
+        '''
+        Test that the urls found are the ones the regex finds.
+        '''
+        regex = re.compile(urls.GRUBER)
+        parts = ['a', 'W', 'www', '1', '.', '..', ':', '/', '//', '(', ')',
+                 '-', '_', '%', 'com', 'x.co', 'http', 'é', ' ', '<', ',',
+                 '!', 'İ']
+        rng = random.Random(1)
+        for i in range(5000):
+            text = ''.join(rng.choice(parts)
+                           for j in range(rng.randint(0, 10)))
+            self.assertEqual(urls.find_urls(text),
+                             [m.group() for m in regex.finditer(text)], text)
+            self.assertEqual(urls.remove_urls(text), regex.sub('', text))
+
+    def test_adversarial(self):
+        '''
+        Test texts the regex backtracks on for ages.
+        '''
+        text = 'http://x' + '.' * 5000 + ' '
+        self.assertEqual(urls.remove_urls(text), '.' * 5000 + ' ')
+        text = 'www.ab' + '((a)' * 5000
+        self.assertEqual(urls.find_urls(text), ['www.ab'])
+        text = 'a-' * 5000 + ':' + '!' * 5000
+        self.assertEqual(urls.find_urls(text), [])